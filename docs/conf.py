@@ -32,6 +32,9 @@ extensions = ['sphinx.ext.autodoc',
               'sphinx_autodoc_typehints',  # https://github.com/agronholm/sphinx-autodoc-typehints/blob/master/README.rst
 ]
 
+# resolve annotations whose imports are guarded by TYPE_CHECKING, e.g. numpy:
+set_type_checking_flag = True
+
 # Add any paths that contain templates here, relative to this directory.
 templates_path = ['_templates']
 
@@ -1,15 +1,28 @@
 from __future__ import annotations
-from typing import List, Dict, Union
-from json import load, dump
+from typing import List, Dict, Union, Callable, Iterator, Iterable, Tuple, Hashable, TYPE_CHECKING
+from json import load, dump, loads, dumps, JSONDecoder
 import csv
 from datetime import datetime
-from annif_client import AnnifClient
 import os.path
-import urllib3
-import xmltodict
 import ast
-import scipy.stats
-from sklearn.metrics import f1_score, recall_score, precision_score
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from functools import partial
+from urllib.parse import urlparse
+import hashlib
+import threading
+import codecs
+import random
+import math
+import re
+import time
+import sys
+import tracemalloc
+
+if TYPE_CHECKING:
+    import asyncio
+    from concurrent.futures import ProcessPoolExecutor
+    import numpy
 
 
 DIR = os.path.dirname(__file__)
@@ -66,10 +79,1019 @@ class Utility:
                 cls.save_json(json_slice, DIR + f"{save_path}_{position}-{position + 5000}.json")
                 position = position + 5000
 
+    @classmethod
+    def benchmark_import(cls,
+                         modules: List[str] = None,
+                         repeat: int = 5,
+                         top: int = 10) -> Dict[str, Dict]:
+        """ Benchmark the import time of modules in fresh interpreters with python -X importtime.
+
+        The import time of a module is the best cumulative time over repeat runs. The slowest imports are the modules
+        with the largest cumulative times in the best run.
+
+        :param modules: the modules to be imported, defaults to files
+        :param repeat: number of runs per module, defaults to 5
+        :param top: number of slowest imports reported per module, defaults to 10
+        """
+
+        import subprocess
+
+        if modules is None:
+            modules = ["files"]
+
+        results = dict()
+        for module in modules:
+            best = None
+            for _ in range(repeat):
+                process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                         cwd=os.path.dirname(DIR), capture_output=True, text=True, check=True)
+                lines = []
+                for line in process.stderr.splitlines():
+                    if not line.startswith("import time:") or "cumulative" in line:
+                        continue
+                    _, cumulative, name = line[len("import time:"):].split("|")
+                    lines.append((name.strip(), len(name) - len(name.lstrip()), int(cumulative) / 1000))
+
+                # the nested imports of the module are listed right before it with deeper indentation:
+                position = max(position for position, line in enumerate(lines) if line[0] == module)
+                total = lines[position][2]
+                imports = []
+                for name, depth, milliseconds in reversed(lines[:position]):
+                    if depth <= lines[position][1]:
+                        break
+                    imports.append((name, milliseconds))
+                if best is None or total < best[0]:
+                    best = (total, imports)
+
+            results[module] = {"import ms": best[0],
+                               "slowest": [{"module": name, "cumulative ms": milliseconds} for name, milliseconds
+                                           in sorted(best[1], key=lambda entry: entry[1], reverse=True)[:top]]}
+            print(f"import {module}: {best[0]:.1f} ms")
+
+        return results
+
+
+class Monitor:
+    """ A collection of instrumentation functions.
+
+    Timers, counters, cache statistics and the memory peak are collected per run and saved as a JSON report in
+    /reports/. Latency timers wrap waits that overlap in concurrent coroutines, so their seconds are summed latencies
+    rather than wall time.
+    """
+
+    name = None
+    active = False
+    started = time.time()
+    timers = dict()
+    counters = dict()
+    caches = dict()
+    profiler = None
+    # whether the current run started tracemalloc or set the trace function, and the trace function it replaced:
+    tracing = None
+    traced = False
+    previous_trace = None
+    lock = threading.Lock()
+
+    @classmethod
+    def start_run(cls,
+                  name: str,
+                  profile: bool = False,
+                  trace: Callable = None,
+                  memory: bool = False) -> None:
+        """ Start a run and reset all timers, counters and cache statistics.
+
+        If memory is traced, the memory peak of the run is traced with tracemalloc, which slows Python code down about
+        twofold. Note that cProfile and the trace function only cover the calling thread.
+
+        :param name: the name of the run
+        :param profile: toggle cProfile for the run, defaults to False
+        :param trace: trace function to be passed to sys.settrace for the run, defaults to None
+        :param memory: toggle trace the memory peak of the run with tracemalloc, defaults to False
+        """
+
+        with cls.lock:
+            cls.name = name
+            cls.active = True
+            cls.started = time.time()
+            cls.timers = dict()
+            cls.counters = dict()
+            cls.caches = dict()
+
+        cls.tracing = None
+        if memory is True:
+            cls.tracing = not tracemalloc.is_tracing()
+            if cls.tracing is True:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+
+        if profile is True:
+            import cProfile
+            cls.profiler = cProfile.Profile()
+            cls.profiler.enable()
+        cls.traced = trace is not None
+        if trace is not None:
+            cls.previous_trace = sys.gettrace()
+            sys.settrace(trace)
+
+    @classmethod
+    @contextmanager
+    def timer(cls,
+              name: str,
+              latency: bool = False):
+        """ Time a block of code; can also be used as a decorator.
+
+        For example: with Monitor.timer("pubmed", latency=True): ...
+
+        :param name: the name of the timer, usually a pipeline stage or an external service
+        :param latency: toggle report the timer as latency of calls that may overlap, which has no items per second,
+            defaults to False
+        """
+
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with cls.lock:
+                timer = cls.timers.setdefault(name, {"calls": 0, "seconds": 0.0, "max seconds": 0.0, "errors": 0})
+                timer["latency"] = latency
+                timer["calls"] = timer["calls"] + 1
+                timer["seconds"] = timer["seconds"] + elapsed
+                timer["max seconds"] = max(timer["max seconds"], elapsed)
+                if failed is True:
+                    timer["errors"] = timer["errors"] + 1
+
+    @classmethod
+    def count(cls,
+              name: str,
+              value: int = 1) -> None:
+        """ Increase a counter.
+
+        A counter with the same name as a timer is reported as the number of items processed by the timer.
+
+        :param name: the name of the counter
+        :param value: the increment, defaults to 1
+        """
+
+        with cls.lock:
+            cls.counters[name] = cls.counters.get(name, 0) + value
+
+    @classmethod
+    def cache(cls,
+              name: str,
+              hit: bool) -> None:
+        """ Record a cache lookup.
+
+        :param name: the name of the cache
+        :param hit: whether the lookup was a hit
+        """
+
+        with cls.lock:
+            cache = cls.caches.setdefault(name, {"hits": 0, "misses": 0})
+            if hit is True:
+                cache["hits"] = cache["hits"] + 1
+            else:
+                cache["misses"] = cache["misses"] + 1
+
+    @classmethod
+    def get_memory_peak(cls) -> Union[float, None]:
+        """ Get the memory high-water mark of the process in MB over its whole lifetime if available.
+
+        Unlike the memory peak of a run, this includes all earlier runs in the process and memory outside Python.
+        """
+
+        try:
+            import resource
+        except ImportError:
+            return None
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        if sys.platform == "darwin":
+            return peak / (1024 * 1024)
+        else:
+            return peak / 1024
+
+    @classmethod
+    def make_report(cls) -> Dict:
+        """ Make a report of the current run. """
+
+        seconds = time.time() - cls.started
+
+        with cls.lock:
+            stages = dict()
+            for name, timer in cls.timers.items():
+                stage = dict(timer)
+                stage["mean seconds"] = timer["seconds"] / timer["calls"]
+                if timer["latency"] is True:
+                    stage = {"calls": timer["calls"], "summed latency seconds": timer["seconds"],
+                             "mean latency seconds": stage["mean seconds"], "max latency seconds": timer["max seconds"],
+                             "errors": timer["errors"]}
+                elif name in cls.counters:
+                    stage["items"] = cls.counters.get(name)
+                    stage["items per second"] = stage["items"] / timer["seconds"] if timer["seconds"] > 0 else None
+                stages[name] = stage
+
+            caches = dict()
+            for name, cache in cls.caches.items():
+                lookups = cache["hits"] + cache["misses"]
+                caches[name] = {"hits": cache["hits"],
+                                "misses": cache["misses"],
+                                "hit rate": cache["hits"] / lookups if lookups > 0 else None}
+
+            counters = dict(cls.counters)
+
+        return {"run": cls.name,
+                "started": str(datetime.fromtimestamp(cls.started)).split(".")[0],
+                "seconds": seconds,
+                "memory peak MB": tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+                if cls.tracing is not None and tracemalloc.is_tracing() else None,
+                "process memory peak MB": cls.get_memory_peak(),
+                "stages": stages,
+                "counters": counters,
+                "caches": caches}
+
+    @classmethod
+    def save_report(cls,
+                    save_path: str = None) -> str:
+        """ Save the report of the current run as JSON file and stop the profiling and tracing that the run started.
+
+        If the run is profiled, the cProfile statistics are saved next to the report with extension .prof and the
+        top functions by cumulative time are added to the report.
+
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /reports/report_{run}_{timestamp}.json
+        """
+
+        if cls.traced is True:
+            sys.settrace(cls.previous_trace)
+            cls.traced = False
+            cls.previous_trace = None
+        cls.active = False
+
+        report = cls.make_report()
+        if cls.tracing is True:
+            tracemalloc.stop()
+        cls.tracing = None
+
+        if save_path is None:
+            os.makedirs(DIR + "/reports", exist_ok=True)
+            timestamp = str(datetime.now()).split(".")[0].replace(":", "-").replace(" ", "-")
+            save_path = DIR + f"/reports/report_{cls.name}_{timestamp}.json"
+
+        if cls.profiler is not None:
+            import pstats
+            cls.profiler.disable()
+            profile_path = os.path.splitext(save_path)[0] + ".prof"
+            cls.profiler.dump_stats(profile_path)
+            statistics = pstats.Stats(cls.profiler).stats
+            top = sorted(statistics.items(), key=lambda entry: entry[1][3], reverse=True)[:25]
+            report["profile"] = {"file": profile_path,
+                                 "top": [{"function": f"{function[0]}:{function[1]}({function[2]})",
+                                          "calls": values[1],
+                                          "total seconds": values[2],
+                                          "cumulative seconds": values[3]} for function, values in top]}
+            cls.profiler = None
+
+        Utility.save_json(report, save_path)
+        print(f"Report saved as {save_path}")
+
+        return save_path
+
+    @classmethod
+    @contextmanager
+    def run(cls,
+            name: str,
+            profile: bool = False,
+            trace: Callable = None,
+            save_path: str = None,
+            memory: bool = False):
+        """ Start a run and save its report at the end, even if the run fails.
+
+        If a run is already active, the block is recorded as part of the active run instead.
+
+        For example: with Monitor.run("enrich"): ...
+
+        :param name: the name of the run
+        :param profile: toggle cProfile for the run, defaults to False
+        :param trace: trace function to be passed to sys.settrace for the run, defaults to None
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /reports/report_{run}_{timestamp}.json
+        :param memory: toggle trace the memory peak of the run with tracemalloc, defaults to False
+        """
+
+        # claim the run under the lock so that concurrent stages do not both start one:
+        with cls.lock:
+            nested = cls.active
+            cls.active = True
+
+        if nested is True:
+            yield
+            return
+
+        cls.start_run(name=name, profile=profile, trace=trace, memory=memory)
+        try:
+            yield
+        finally:
+            cls.save_report(save_path=save_path)
+
+
+class Http:
+    """ A shared asyncio-based HTTP layer for PubMed, Finto and Annif.
+
+    All requests run on one background event loop with per-host connection limits, rate limits, timeouts, retries
+    with jitter and circuit breakers. Identical requests in flight share one result. Synchronous code submits
+    coroutines with Http.run or Http.gather, so enrichers running in different threads share the same limits.
+    """
+
+    annif_api = "https://api.annif.org/v1/"
+    hosts = {"eutils.ncbi.nlm.nih.gov": {"connections": 3, "rate": 3},
+             "api.finto.fi": {"connections": 5, "rate": 10},
+             "api.annif.org": {"connections": 5, "rate": None}}
+    default_host = {"connections": 5, "rate": None}
+    timeout = 30
+    retries = 4
+    backoff = 0.5
+    failure_threshold = 5
+    cooldown = 30
+
+    loop = None
+    pool = None
+    states = dict()
+    inflight = dict()
+    lock = threading.Lock()
+
+    @classmethod
+    def get_loop(cls) -> asyncio.AbstractEventLoop:
+        """ Get the background event loop and start it if necessary. """
+
+        import asyncio
+        import urllib3
+
+        with cls.lock:
+            if cls.loop is None:
+                connections = [host.get("connections") for host in list(cls.hosts.values()) + [cls.default_host]]
+                cls.pool = urllib3.PoolManager(maxsize=max(connections), block=True,
+                                               timeout=urllib3.Timeout(connect=10, read=cls.timeout))
+                cls.loop = asyncio.new_event_loop()
+                cls.loop.set_default_executor(ThreadPoolExecutor(max_workers=sum(connections)))
+                threading.Thread(target=cls.loop.run_forever, name="http", daemon=True).start()
+
+        return cls.loop
+
+    @classmethod
+    def get_state(cls,
+                  host: str) -> Dict:
+        """ Get the connection limit, rate limit and circuit state of a host.
+
+        :param host: the host name
+        """
+
+        import asyncio
+
+        state = cls.states.get(host)
+        if state is None:
+            config = cls.hosts.get(host, cls.default_host)
+            state = {"connections": asyncio.Semaphore(config.get("connections")),
+                     "rate": config.get("rate"),
+                     "rate lock": asyncio.Lock(),
+                     "next slot": 0.0,
+                     "failures": 0,
+                     "open until": 0.0,
+                     "probe": None}
+            cls.states[host] = state
+
+        return state
+
+    @classmethod
+    async def wait_for_slot(cls,
+                            state: Dict) -> None:
+        """ Wait until the rate limit of a host allows the next request.
+
+        :param state: the state of the host
+        """
+
+        import asyncio
+
+        if state.get("rate") is None:
+            return
+
+        async with state.get("rate lock"):
+            now = time.monotonic()
+            delay = state.get("next slot") - now
+            state["next slot"] = max(now, state.get("next slot")) + 1 / state.get("rate")
+
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    @classmethod
+    async def wait_for_circuit(cls,
+                               host: str,
+                               state: Dict) -> bool:
+        """ Wait until the circuit of a host lets a request through and return whether the request is the probe.
+
+        :param host: the host name
+        :param state: the state of the host
+        """
+
+        import asyncio
+
+        while True:
+            wait = state.get("open until") - time.monotonic()
+            if wait > 0:
+                Monitor.count(f"http {host} circuit waits")
+                await asyncio.sleep(wait)
+            elif state.get("failures") < cls.failure_threshold:
+                return False
+            elif state.get("probe") is None:
+                state["probe"] = asyncio.Event()
+                Monitor.count(f"http {host} circuit probes")
+                return True
+            else:
+                await state.get("probe").wait()
+
+    @classmethod
+    async def send(cls,
+                   method: str,
+                   url: str,
+                   fields: Dict = None) -> bytes:
+        """ Send a request and return the response body.
+
+        Failed requests, timeouts and responses with status 429 or 5xx are retried with exponential backoff and full
+        jitter. After failure_threshold failures in a row, the circuit of the host opens: requests wait out the cooldown
+        instead of hitting the host. Then the circuit is half-open: exactly one request probes the host while the others
+        wait for it. If the probe succeeds, the circuit closes; if it fails, the circuit opens again.
+
+        :param method: GET or POST
+        :param url: the URL
+        :param fields: query parameters for GET or form fields for POST, defaults to None
+        """
+
+        import asyncio
+        import urllib3
+
+        host = urlparse(url).hostname
+        state = cls.get_state(host)
+        loop = asyncio.get_running_loop()
+
+        for attempt in range(cls.retries + 1):
+            probe = await cls.wait_for_circuit(host, state)
+            try:
+                async with state.get("connections"):
+                    await cls.wait_for_slot(state)
+                    with Monitor.timer(f"http {host}", latency=True):
+                        if method == "POST":
+                            call = partial(cls.pool.request, method, url, fields=fields, encode_multipart=False,
+                                           retries=False)
+                        else:
+                            call = partial(cls.pool.request, method, url, fields=fields, retries=False)
+                        response = await asyncio.wait_for(loop.run_in_executor(None, call), timeout=2 * cls.timeout)
+                if response.status in [429, 500, 502, 503, 504]:
+                    raise ConnectionError(f"{host} responded with status {response.status}")
+                state["failures"] = 0
+                if response.status >= 400:
+                    raise ValueError(f"{url} responded with status {response.status}")
+                return response.data
+            except (urllib3.exceptions.HTTPError, ConnectionError, asyncio.TimeoutError) as error:
+                state["failures"] = state.get("failures") + 1
+                if state.get("failures") >= cls.failure_threshold:
+                    state["open until"] = time.monotonic() + cls.cooldown
+                if attempt == cls.retries:
+                    raise ConnectionError(f"{method} {url} failed: {error}") from error
+                Monitor.count(f"http {host} retries")
+                await asyncio.sleep(random.uniform(0, cls.backoff * 2 ** attempt))
+            finally:
+                # let the requests waiting for the probe check the circuit again:
+                if probe is True:
+                    state.get("probe").set()
+                    state["probe"] = None
+
+    @classmethod
+    async def request(cls,
+                      method: str,
+                      url: str,
+                      fields: Dict = None) -> bytes:
+        """ Send a request unless an identical request is in flight and return the response body.
+
+        :param method: GET or POST
+        :param url: the URL
+        :param fields: query parameters for GET or form fields for POST, defaults to None
+        """
+
+        import asyncio
+
+        key = (method, url, tuple(sorted((fields or dict()).items())))
+        task = cls.inflight.get(key)
+        Monitor.cache("http coalescing", task is not None)
+
+        if task is None:
+            task = asyncio.ensure_future(cls.send(method, url, fields))
+            cls.inflight[key] = task
+            task.add_done_callback(lambda done: cls.inflight.pop(key, None))
+
+        return await asyncio.shield(task)
+
+    @classmethod
+    def run(cls,
+            coroutine):
+        """ Run a coroutine on the background event loop and return its result.
+
+        :param coroutine: the coroutine
+        """
+
+        import asyncio
+
+        return asyncio.run_coroutine_threadsafe(coroutine, cls.get_loop()).result()
+
+    @classmethod
+    async def collect(cls,
+                      coroutines: List) -> List:
+        """ Run coroutines concurrently and return their results in order; failed coroutines return their exception.
+
+        :param coroutines: the coroutines
+        """
+
+        import asyncio
+
+        return list(await asyncio.gather(*coroutines, return_exceptions=True))
+
+    @classmethod
+    def run_batch(cls,
+                  batch: List) -> List:
+        """ Run a batch of coroutines concurrently and return their results in order.
+
+        The wall time of the batch is recorded by the timer http batches, so that its items per second are the request
+        throughput, unlike the summed latencies of the timers of the requests.
+
+        :param batch: the coroutines
+        """
+
+        Monitor.count("http batches", len(batch))
+        with Monitor.timer("http batches"):
+            return cls.run(cls.collect(batch))
+
+    @classmethod
+    def gather(cls,
+               coroutines: Iterable,
+               batch_size: int = 1000) -> List:
+        """ Run coroutines concurrently on the background event loop and return their results in order.
+
+        The coroutines are started in batches so that memory stays bounded for large corpora. A failed coroutine does
+        not abort the others: its result is None and the failure is printed and counted.
+
+        :param coroutines: the coroutines
+        :param batch_size: the number of coroutines started at once, defaults to 1000
+        """
+
+        results = []
+        batch = []
+        for coroutine in coroutines:
+            batch.append(coroutine)
+            if len(batch) == batch_size:
+                results.extend(cls.run_batch(batch))
+                batch = []
+        if len(batch) > 0:
+            results.extend(cls.run_batch(batch))
+
+        for position, result in enumerate(results):
+            if isinstance(result, Exception):
+                print(f"Warning: request failed: {result}")
+                Monitor.count("http failures")
+                results[position] = None
+
+        return results
+
+
+class Selection:
+    """ A collection of functions for selecting Edoc items with composable predicates.
+
+    A predicate is a function that takes an item and returns True if the item is selected. Predicates on indexed fields
+    carry hints so that Selection.select can look up candidate items in a secondary index instead of parsing every item.
+    A hint is a field with the accepted values, either as a set or as a function that tests an indexed value.
+    """
+
+    chunk_size = 1024 * 1024
+    indexed_fields = ["department", "year", "type", "language"]
+    indexes = dict()
+
+    @classmethod
+    def get_values(cls,
+                   item: Dict,
+                   field: str) -> List[str]:
+        """ Get the values of a field of an item as strings.
+
+        The field year is derived from the field date.
+
+        :param item: the Edoc item
+        :param field: the field
+        """
+
+        if field == "year":
+            year = str(item.get("date"))[:4]
+            return [year] if year.isdigit() else []
+
+        value = item.get(field)
+        if value is None:
+            return []
+        elif isinstance(value, list):
+            return [str(entry) for entry in value]
+        else:
+            return [str(value)]
+
+    @classmethod
+    def has(cls,
+            *fields: str) -> Callable:
+        """ Make a predicate that selects items that have all fields.
+
+        :param fields: the required fields
+        """
+
+        def predicate(item: Dict) -> bool:
+            for field in fields:
+                if field not in item:
+                    return False
+            return True
+
+        predicate.hints = []
+
+        return predicate
+
+    @classmethod
+    def equals(cls,
+               field: str,
+               *values: str) -> Callable:
+        """ Make a predicate that selects items where the field has one of the values.
+
+        For example: Selection.equals("department", "Faculty_of_Science", "Faculty_of_Medicine")
+
+        :param field: the field, for example department, year, type or language
+        :param values: the accepted values
+        """
+
+        accepted = {str(value) for value in values}
+
+        def predicate(item: Dict) -> bool:
+            for value in cls.get_values(item, field):
+                if value in accepted:
+                    return True
+            return False
+
+        predicate.hints = [(field, accepted)] if field in cls.indexed_fields else []
+
+        return predicate
+
+    @classmethod
+    def between(cls,
+                field: str,
+                start: int,
+                end: int) -> Callable:
+        """ Make a predicate that selects items where the numeric field is between start and end (both included).
+
+        For example: Selection.between("year", 2011, 2020)
+
+        :param field: the field, for example year
+        :param start: the smallest accepted value
+        :param end: the largest accepted value
+        """
+
+        def predicate(item: Dict) -> bool:
+            for value in cls.get_values(item, field):
+                try:
+                    if start <= int(value) <= end:
+                        return True
+                except ValueError:
+                    continue
+            return False
+
+        def accepts(value: str) -> bool:
+            try:
+                return start <= int(value) <= end
+            except ValueError:
+                return False
+
+        # the hint tests the indexed values instead of listing the range, which may be large:
+        predicate.hints = [(field, accepts)] if field in cls.indexed_fields else []
+
+        return predicate
+
+    @classmethod
+    def all_of(cls,
+               *predicates: Callable) -> Callable:
+        """ Make a predicate that selects items selected by all predicates.
+
+        The predicates are tested in the given order and testing stops at the first predicate that fails, so cheap
+        predicates should come first.
+
+        :param predicates: the predicates
+        """
+
+        def predicate(item: Dict) -> bool:
+            for sub_predicate in predicates:
+                if not sub_predicate(item):
+                    return False
+            return True
+
+        predicate.hints = sum([getattr(sub_predicate, "hints", []) for sub_predicate in predicates], [])
+
+        return predicate
+
+    @classmethod
+    def any_of(cls,
+               *predicates: Callable) -> Callable:
+        """ Make a predicate that selects items selected by any of the predicates.
+
+        :param predicates: the predicates
+        """
+
+        def predicate(item: Dict) -> bool:
+            for sub_predicate in predicates:
+                if sub_predicate(item):
+                    return True
+            return False
+
+        predicate.hints = []
+
+        return predicate
+
+    @classmethod
+    def negate(cls,
+               sub_predicate: Callable) -> Callable:
+        """ Make a predicate that selects items not selected by the predicate.
+
+        :param sub_predicate: the predicate
+        """
+
+        def predicate(item: Dict) -> bool:
+            return not sub_predicate(item)
+
+        predicate.hints = []
+
+        return predicate
+
+    @classmethod
+    def get_paths(cls,
+                  path: Union[str, List[str]]) -> List[str]:
+        """ Get the JSON files of raw or sharded input.
+
+        :param path: complete path to file including filename and extension, complete path to folder of files, or
+            list thereof
+        """
+
+        if isinstance(path, list):
+            return sum([cls.get_paths(entry) for entry in path], [])
+        elif os.path.isdir(path):
+            return [f"{path}/{file}" for file in sorted(os.listdir(path)) if file.endswith(".json")]
+        else:
+            return [path]
+
+    @classmethod
+    def stream(cls,
+               file_path: str) -> Iterator[Tuple[int, int, Dict]]:
+        """ Stream the items of a JSON file that contains a list of items.
+
+        Yields the byte offset and byte length of each item in the file together with the item, so that only one chunk
+        of the file is in memory at a time.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        decoder = JSONDecoder()
+        utf8 = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        position = 0
+        offset = 0
+        end_of_file = False
+
+        with open(file_path, "rb") as file:
+            while True:
+                # skip whitespace and separators between items:
+                while position < len(buffer) and buffer[position] in " \t\r\n,[":
+                    position = position + 1
+                    offset = offset + 1
+
+                if position < len(buffer) and buffer[position] == "]":
+                    return
+
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except ValueError:
+                    if end_of_file is True:
+                        if position == len(buffer):
+                            return
+                        raise
+                    # the item is incomplete, so read the next chunk and drop the consumed part of the buffer:
+                    chunk = file.read(cls.chunk_size)
+                    end_of_file = len(chunk) == 0
+                    buffer = buffer[position:] + utf8.decode(chunk, final=end_of_file)
+                    position = 0
+                    continue
+
+                length = len(buffer[position:end].encode("utf-8"))
+                yield offset, length, item
+
+                offset = offset + length
+                position = end
+
+    @classmethod
+    def get_index_path(cls,
+                       file_path: str) -> str:
+        """ Get the path of the secondary index of a file.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        return file_path + ".idx"
+
+    @classmethod
+    @Monitor.timer("build_index")
+    def build_index(cls,
+                    file_path: str,
+                    fields: List[str] = None) -> Dict:
+        """ Build and save the secondary index of a file.
+
+        The index maps each value of each field to the byte offsets and lengths of the items with that value. It is
+        saved next to the file with extension .idx.
+
+        :param file_path: complete path to file including filename and extension
+        :param fields: the fields to be indexed, defaults to department, year, type and language
+        """
+
+        if fields is None:
+            fields = cls.indexed_fields
+
+        index = {"items": 0, "fields": {field: dict() for field in fields}}
+        for offset, length, item in cls.stream(file_path):
+            for field in fields:
+                for value in cls.get_values(item, field):
+                    index["fields"][field].setdefault(value, []).append([offset, length])
+            index["items"] = index["items"] + 1
+
+        Monitor.count("build_index", index["items"])
+        Utility.save_json(index, cls.get_index_path(file_path))
+        cls.indexes[file_path] = (os.path.getmtime(file_path), index)
+
+        return index
+
+    @classmethod
+    def load_index(cls,
+                   file_path: str) -> Union[Dict, None]:
+        """ Load the secondary index of a file if it exists and is not older than the file.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        index_path = cls.get_index_path(file_path)
+        modified = os.path.getmtime(file_path)
+
+        if file_path in cls.indexes and cls.indexes[file_path][0] == modified:
+            Monitor.cache("index", True)
+            return cls.indexes[file_path][1]
+        Monitor.cache("index", False)
+
+        if not os.path.exists(index_path) or os.path.getmtime(index_path) < modified:
+            return None
+
+        index = Utility.load_json(index_path)
+        cls.indexes[file_path] = (modified, index)
+
+        return index
+
+    @classmethod
+    def select(cls,
+               path: Union[str, List[str]],
+               predicate: Callable,
+               use_index: bool = True) -> Iterator[Dict]:
+        """ Select items from raw or sharded input.
+
+        If the predicate has hints on indexed fields and an up to date index exists, only the candidate items from the
+        index are parsed; otherwise the input is streamed.
+
+        For example: Selection.select(DIR + "/raw", Selection.all_of(Selection.equals("department", "Faculty_of_Law"),
+        Selection.has("abstract")))
+
+        :param path: complete path to file including filename and extension, complete path to folder of files, or
+            list thereof
+        :param predicate: the predicate
+        :param use_index: toggle use secondary indexes, defaults to True
+        """
+
+        hints = getattr(predicate, "hints", [])
+
+        for file_path in cls.get_paths(path):
+
+            index = None
+            if use_index is True and len(hints) > 0:
+                index = cls.load_index(file_path)
+                if index is not None and not all(field in index["fields"] for field, values in hints):
+                    index = None
+
+            if index is None:
+                for offset, length, item in cls.stream(file_path):
+                    Monitor.count("select")
+                    if predicate(item):
+                        yield item
+                continue
+
+            # intersect the candidates of all hints:
+            candidates = None
+            for field, values in hints:
+                if callable(values):
+                    values = [value for value in index["fields"][field] if values(value)]
+                positions = set()
+                for value in values:
+                    positions.update((position[0], position[1]) for position in index["fields"][field].get(value, []))
+                candidates = positions if candidates is None else candidates & positions
+
+            with open(file_path, "rb") as file:
+                for offset, length in sorted(candidates):
+                    file.seek(offset)
+                    item = loads(file.read(length).decode("utf-8"))
+                    Monitor.count("select")
+                    if predicate(item):
+                        yield item
+
+    @classmethod
+    @Monitor.timer("select")
+    def select_to_file(cls,
+                       path: Union[str, List[str]],
+                       save_path: str,
+                       predicate: Callable,
+                       use_index: bool = True) -> int:
+        """ Select items from raw or sharded input, save them as JSON file and return their number.
+
+        :param path: complete path to file including filename and extension, complete path to folder of files, or
+            list thereof
+        :param save_path: complete path to save folder including filename and extension
+        :param predicate: the predicate
+        :param use_index: toggle use secondary indexes, defaults to True
+        """
+
+        selected = list(cls.select(path, predicate, use_index=use_index))
+        Utility.save_json(selected, save_path)
+        print(f"{len(selected)} items selected")
+
+        return len(selected)
+
+
+class Planner:
+    """ A collection of functions for planning deduplicated enrichment.
+
+    An enrichment is planned by collecting the work units (keywords, PubMed IDs, texts) of all items, resolving each
+    distinct work unit once and fanning the results back out to the items.
+    """
+
+    @classmethod
+    def plan(cls,
+             name: str,
+             data: List[Dict],
+             get_units: Callable[[Dict], List[Hashable]]) -> Tuple[List[List[Hashable]], List[Hashable]]:
+        """ Collect the work units per item and the distinct work units across all items.
+
+        The deduplication ratio (work units per distinct work unit) is printed and recorded by Monitor.
+
+        :param name: the name of the enrichment
+        :param data: the items
+        :param get_units: function that returns the work units of an item
+        """
+
+        units_per_item = []
+        distinct = dict()
+        for item in data:
+            units = get_units(item)
+            units_per_item.append(units)
+            for unit in units:
+                distinct[unit] = None
+
+        occurrences = sum(len(units) for units in units_per_item)
+        Monitor.count(f"{name} units", occurrences)
+        Monitor.count(f"{name} distinct units", len(distinct))
+        ratio = occurrences / len(distinct) if len(distinct) > 0 else 1.0
+        print(f"{name}: {occurrences} work units, {len(distinct)} distinct, deduplication ratio {ratio:.2f}")
+
+        return units_per_item, list(distinct)
+
+    @classmethod
+    def resolve(cls,
+                distinct: List[Hashable],
+                results: List) -> Dict[Hashable, object]:
+        """ Map each distinct work unit to its result.
+
+        :param distinct: the distinct work units
+        :param results: the results in the same order
+        """
+
+        return dict(zip(distinct, results))
+
 
 class Data:
     """ A collection of Edoc data functions. """
 
+    references = dict()
+
     @classmethod
     def select_from_data(cls,
                          data: List[Dict],
@@ -82,36 +1104,50 @@ class Data:
         :param fields: the required fields for an item to be sample
         """
 
-        selected = []
-        for item in data:
-            keep_item = True
-            for field in fields:
-                if field not in item:
-                    keep_item = False
-                    break
-            if keep_item is True:
-                selected.append(item)
+        predicate = Selection.has(*fields)
 
-        return selected
+        return [item for item in data if predicate(item)]
 
     @classmethod
     def select_from_file(cls,
                          file_path: str,
-                         *fields: str) -> None:
+                         *fields: str,
+                         save_path: str = None) -> None:
         """ Select items from file according to fields.
 
+        The file is streamed; see Selection for selecting by department, year, type or language.
+
         For example: select_from_file(DIR + "/raw/2019.json", "title", "abstract", "keywords", "id_number")
 
         :param file_path: complete path to file including filename and extension
         :param fields: the required fields for an item to be sample
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /sample/{timestamp}
         """
 
-        data = Utility.load_json(file_path)
-        print(f"{file_path} loaded")
-        selected = Data.select_from_data(data, *fields)
-        print(f"Items sample")
-        save_file_path = DIR + "/sample/" + str(datetime.now()).split(".")[0].replace(":", "-").replace(" ", "-")
-        Utility.save_json(selected, save_file_path)
+        if save_path is None:
+            save_path = DIR + "/sample/" + str(datetime.now()).split(".")[0].replace(":", "-").replace(" ", "-")
+        Selection.select_to_file(file_path, save_path, Selection.has(*fields))
+
+    @classmethod
+    def select_from_files(cls,
+                          file_paths: List[str],
+                          save_path: str,
+                          *fields: str) -> None:
+        """ Select items from several files according to fields and save them as one file.
+
+        For example: select_from_files([DIR + "/raw/raw_master_2019.json", DIR + "/raw/raw_master_2020.json"],
+        DIR + "/sample/sample_master.json", "title", "abstract", "keywords", "id_number")
+
+        :param file_paths: complete paths to files including filename and extension
+        :param save_path: complete path to save folder including filename and extension
+        :param fields: the required fields for an item to be sample
+        """
+
+        if len(file_paths) == 0:
+            raise ValueError("No raw Edoc files to select from")
+
+        Selection.select_to_file(file_paths, save_path, Selection.has(*fields))
 
     @classmethod
     def inspect(cls,
@@ -135,68 +1171,132 @@ class Data:
         print(f"Items in data: {len(data)}")
 
     @classmethod
+    @Monitor.timer("enrich_author_keywords")
     def enrich_author_keywords(cls,
                                file_path: str,
-                               save_path: str) -> None:
+                               save_path: str,
+                               reference_path: str = None) -> None:
         """ Enrich author keywords.
 
-        For each Edoc item: the string of author keywords is cut into single keywords and each keyword is cleaned. Each
-        keyword is then enriched with Qid, MeSH and YSO ID if available.
+        For each Edoc item: the string of author keywords is cut into single keywords and each keyword is cleaned,
+        unless the item already has clean keywords from clean_author_keywords. Each keyword is then enriched with Qid,
+        MeSH and YSO ID if available. Each distinct keyword is mapped only once.
 
         :param file_path: complete path to file including filename and extension
         :param save_path: complete path to save folder including filename without extension
+        :param reference_path: complete path to reference keywords including filename and extension, defaults to
+            /keywords/keywords_reference_master.json
         """
 
         data = Utility.load_json(file_path)
         modified_data = []
 
-        for item in data:
+        # clean keywords
+        keywords_per_item, distinct = Planner.plan("keywords", data, cls.get_clean_keywords)
 
-            # make deep copy of item:
-            modified_item = dict(item)
+        # enrich keywords
+        enriched = Planner.resolve(distinct, [cls.map2reference(keyword, reference_path) for keyword in distinct])
 
-            # clean keywords
-            keywords = modified_item.get("keywords")
-            keywords_clean = Keywords.clean_keywords([keywords])
+        for item, keywords_clean in zip(data, keywords_per_item):
 
-            # enrich keywords
-            enriched_keywords = []
-            for keyword in keywords_clean:
-                enriched_keywords.append(cls.map2reference(keyword))
+            Monitor.count("enrich_author_keywords")
+
+            # make deep copy of item:
+            modified_item = dict(item)
 
-            modified_item["keywords enriched"] = enriched_keywords
+            modified_item["keywords enriched"] = [enriched[keyword] for keyword in keywords_clean]
 
             # add modified item to output:
             modified_data.append(modified_item)
 
         Utility.save_json(modified_data, save_path + ".json")
 
+    @classmethod
+    def get_clean_keywords(cls,
+                           item: Dict) -> List[str]:
+        """ Get the clean keywords of an item, cleaning its author keywords unless this was done before.
+
+        :param item: the Edoc item
+        """
+
+        if "keywords clean" in item:
+            return item.get("keywords clean")
+
+        return Keywords.clean_keywords([item.get("keywords")])
+
+    @classmethod
+    @Monitor.timer("clean_author_keywords")
+    def clean_author_keywords(cls,
+                              file_path: str,
+                              save_path: str) -> None:
+        """ Clean the author keywords of each item in file and add them as list of clean keywords.
+
+        :param file_path: complete path to file including filename and extension
+        :param save_path: complete path to save folder including filename and extension
+        """
+
+        data = Utility.load_json(file_path)
+        for item in data:
+            item["keywords clean"] = Keywords.clean_keywords([item.get("keywords")])
+
+        Monitor.count("clean_author_keywords", len(data))
+        Utility.save_json(data, save_path)
+
     @classmethod
     def map2reference(cls,
-                      keyword: str) -> Dict:
+                      keyword: str,
+                      reference_path: str = None) -> Dict:
         """ Map a keyword to its reference keyword.
 
         Keyword must first be cleaned by corresponding _Keyword method.
 
         :param keyword: the keyword
+        :param reference_path: complete path to reference keywords including filename and extension, defaults to
+            /keywords/keywords_reference_master.json
         """
 
-        # load reference keywords:
-        keywords_reference = Utility.load_json(DIR + "/keywords/keywords_reference_master.json")
-
-        # enrich keywords
-        for entry in keywords_reference:
-            if entry["keyword clean"] == keyword:
-                return entry
+        entry = cls.get_reference(reference_path).get(keyword)
+        if entry is not None:
+            return entry
 
         print(f"No reference found for {keyword}!")
 
     @classmethod
+    def get_reference(cls,
+                      file_path: str = None) -> Dict[str, Dict]:
+        """ Get the reference keywords by clean keyword.
+
+        The file is loaded once and loaded again only if it changes. For duplicate clean keywords the first entry is
+        used.
+
+        :param file_path: complete path to file including filename and extension, defaults to
+            /keywords/keywords_reference_master.json
+        """
+
+        if file_path is None:
+            file_path = DIR + "/keywords/keywords_reference_master.json"
+
+        modified = os.path.getmtime(file_path)
+        cached = cls.references.get(file_path)
+        Monitor.cache("reference", cached is not None and cached[0] == modified)
+
+        if cached is None or cached[0] != modified:
+            reference = dict()
+            for entry in Utility.load_json(file_path):
+                reference.setdefault(entry["keyword clean"], entry)
+            cls.references[file_path] = (modified, reference)
+
+        return cls.references[file_path][1]
+
+    @classmethod
+    @Monitor.timer("enrich_with_mesh")
     def enrich_with_mesh(cls,
                          file_path: str,
                          save_path: str) -> None:
         """ Enrich Edoc data per item with MeSH keywords from PubMed if available.
 
+        The MeSH keywords of each distinct PubMed ID are fetched once, concurrently via Http.
+
         :param file_path: complete path to file including filename and extension
         :param save_path: complete path to save folder including filename without extension
         """
@@ -204,29 +1304,45 @@ class Data:
         data = Utility.load_json(file_path)
         modified_data = []
 
-        for item in data:
+        # find PubMed ID if available and fetch MeSH once per PubMed ID:
+        pmids_per_item, distinct = Planner.plan("pubmed", data, cls.get_pmid)
+        meshes = Planner.resolve(distinct, Http.gather(cls.fetch_mesh_async(pmid_id) for pmid_id in distinct))
+
+        for item, pmids in zip(data, pmids_per_item):
 
             # sanity check:
             print(item.get("title"))
+            Monitor.count("enrich_with_mesh")
 
             # make deep copy of item:
             modified_item = dict(item)
 
-            # find PubMed ID if available
-            identifiers = modified_item.get("id_number") # identifiers is list of dict
-            for identifier in identifiers:
-                if identifier.get("type") == "pmid":
-                    pmid_id = identifier.get("id")
-
-                    # add MeSH based on PubMed ID:
-                    mesh = cls.fetch_mesh(pmid_id)
-                    modified_item["mesh"] = mesh
+            # add MeSH based on PubMed ID; skip PubMed IDs whose fetch failed:
+            for pmid_id in pmids:
+                if meshes[pmid_id] is not None:
+                    modified_item["mesh"] = meshes[pmid_id]
 
             # add modified item to output:
             modified_data.append(modified_item)
 
         Utility.save_json(modified_data, save_path + ".json")
 
+    @classmethod
+    def get_pmid(cls,
+                 item: Dict) -> List[str]:
+        """ Get the PubMed ID of an item as list; the list is empty if there is none.
+
+        :param item: the Edoc item
+        """
+
+        pmid_id = None
+        identifiers = item.get("id_number") # identifiers is list of dict
+        for identifier in identifiers:
+            if identifier.get("type") == "pmid":
+                pmid_id = identifier.get("id")
+
+        return [] if pmid_id is None else [pmid_id]
+
     @classmethod
     def fetch_mesh(cls,
                    pubmed_id: str) -> List[Dict]:
@@ -235,12 +1351,24 @@ class Data:
         :param pubmed_id: article PubMed ID
         """
 
+        return Http.run(cls.fetch_mesh_async(pubmed_id))
+
+    @classmethod
+    async def fetch_mesh_async(cls,
+                               pubmed_id: str) -> List[Dict]:
+        """ Fetch MeSH keywords for article based on PubMed ID via Http.
+
+        :param pubmed_id: article PubMed ID
+        """
+
+        import xmltodict
+
         mesh = []
 
-        http = urllib3.PoolManager()
         url = f"https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id={pubmed_id}&retmode=xml"
-        response = http.request('GET', url)
-        article = xmltodict.parse(response.data)
+        with Monitor.timer("pubmed", latency=True):
+            data = await Http.request("GET", url)
+        article = xmltodict.parse(data)
         try:
             for item in article["PubmedArticleSet"]["PubmedArticle"]["MedlineCitation"]["MeshHeadingList"]["MeshHeading"]:
                 mesh.append({"MeSH descriptor ID": item["DescriptorName"]["@UI"], "MeSH label": item["DescriptorName"]["#text"]})
@@ -250,6 +1378,7 @@ class Data:
         return mesh
 
     @classmethod
+    @Monitor.timer("enrich_with_annif")
     def enrich_with_annif(cls,
                           file_path: str,
                           save_path: str,
@@ -257,9 +1386,13 @@ class Data:
                           abstract: bool = False,
                           fulltext: bool = False,
                           limit: int = None,
-                          threshold: int = None) -> None:
+                          threshold: int = None,
+                          client: LocalAnnif = None) -> None:
         """ Enrich items from file with automatic keywords using Annif-client.
 
+        Each distinct combination of project and text is indexed once. Without client, the Annif REST API at
+        Http.annif_api is queried concurrently via Http.
+
         Available Annif-client project IDs are yso-en, yso-maui-en, yso-bonsai-en, yso-fasttext-en, wikidata-en.
 
         :param file_path: complete path to file including filename and extension
@@ -269,32 +1402,31 @@ class Data:
         :param fulltext: toggle use fulltext for indexing, defaults to False
         :param limit: Annif-client limit, defaults to None
         :param threshold: Annif-client threshold, defaults to None
+        :param client: Annif client with the interface of AnnifClient such as LocalAnnif, defaults to None
         """
 
         data = Utility.load_json(file_path)
-        client = AnnifClient()
         modified_data = []
 
+        # make names for indexing:
+        names = [f"{project_id}-{str(abstract)}-{str(fulltext)}-{str(threshold)}-{str(limit)}"
+                 for project_id in project_ids]
+
         for item in data:
 
             # sanity check:
             print(item.get("title"))
+            Monitor.count("enrich_with_annif")
 
             # make deep copy of item:
             modified_item = dict(item)
 
             # make text to be indexed:
-            text = modified_item.get("title")
-            if abstract is True:
-                text = text + " " + modified_item.get("abstract")
             if fulltext is True:
                 pass
                 # TODO: add fulltext support
 
-            for project_id in project_ids:
-
-                # make name for indexing:
-                name = f"{project_id}-{str(abstract)}-{str(fulltext)}-{str(threshold)}-{str(limit)}"
+            for name in names:
 
                 # check if item has annif-component:
                 if "annif" in modified_item:
@@ -303,30 +1435,130 @@ class Data:
                 else:
                     modified_item["annif"] = dict()
 
-                # actual indexing via Annif-client:
-                results = client.suggest(project_id=project_id, text=text, threshold=threshold, limit=limit)
-
-                # add results to item:
-                modified_item["annif"][name] = results
-
             # add modified item to output:
             modified_data.append(modified_item)
 
+        # actual indexing via Annif-client once per project and text:
+        units_per_item, distinct = Planner.plan("annif", modified_data,
+                                                lambda item: [(project_id, cls.get_text(item, abstract))
+                                                              for project_id in project_ids])
+        if client is None:
+            results = Http.gather(cls.fetch_annif_async(project_id, text, limit=limit, threshold=threshold)
+                                  for project_id, text in distinct)
+        else:
+            results = []
+            for project_id, text in distinct:
+                with Monitor.timer("annif", latency=True):
+                    results.append(client.suggest(project_id=project_id, text=text, threshold=threshold, limit=limit))
+        suggestions = Planner.resolve(distinct, results)
+
+        # add results to item; failed requests are left out so that the item is skipped by the metrics:
+        for modified_item, units in zip(modified_data, units_per_item):
+            for name, unit in zip(names, units):
+                if suggestions[unit] is not None:
+                    modified_item["annif"][name] = suggestions[unit]
+
         Utility.save_json(modified_data, save_path)
 
+    @classmethod
+    def get_text(cls,
+                 item: Dict,
+                 abstract: bool = False) -> str:
+        """ Get the text of an item to be indexed.
+
+        :param item: the Edoc item
+        :param abstract: toggle use abstract for indexing, defaults to False
+        """
+
+        text = item.get("title")
+        if abstract is True:
+            text = text + " " + item.get("abstract")
+
+        return text
+
+    @classmethod
+    async def fetch_annif_async(cls,
+                                project_id: str,
+                                text: str,
+                                limit: int = None,
+                                threshold: int = None) -> List[Dict]:
+        """ Fetch Annif suggestions for a text from the Annif REST API at Http.annif_api via Http.
+
+        :param project_id: Annif-client project ID
+        :param text: the text to be indexed
+        :param limit: Annif-client limit, defaults to None
+        :param threshold: Annif-client threshold, defaults to None
+        """
+
+        fields = {"text": text}
+        if limit is not None:
+            fields["limit"] = limit
+        if threshold is not None:
+            fields["threshold"] = threshold
+
+        with Monitor.timer("annif", latency=True):
+            data = await Http.request("POST", f"{Http.annif_api}projects/{project_id}/suggest", fields)
+
+        return loads(data.decode("utf-8")).get("results")
+
     @classmethod
     def super_enrich_with_annif(cls,
-                                abstract: bool) -> None:
+                                abstract: bool,
+                                file_path: str = None,
+                                save_path: str = None,
+                                client: LocalAnnif = None) -> None:
         """ Enrich items with automatic keywords using all Annif-client projects.
 
-        :param abstract: toggle use abstract for indexing
-        """
+        :param abstract: toggle use abstract for indexing
+        :param file_path: complete path to file including filename and extension, defaults to
+            /indexed/indexed_master.json
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /indexed/indexed_working_{timestamp}.json
+        :param client: Annif client with the interface of AnnifClient such as LocalAnnif, defaults to None
+        """
+
+        if file_path is None:
+            file_path = DIR + "/indexed/indexed_master.json"
+        if save_path is None:
+            save_path = f"{DIR}/indexed/indexed_working_{str(datetime.now()).split('.')[0].replace(':', '-').replace(' ', '-')}.json"
+        project_ids = ["yso-en", "yso-maui-en", "yso-bonsai-en", "yso-fasttext-en", "wikidata-en"]
+
+        with Monitor.run("super_enrich_with_annif"):
+            Data.enrich_with_annif(file_path=file_path, save_path=save_path, project_ids=project_ids, abstract=abstract,
+                                   client=client)
+
+    @classmethod
+    @Monitor.timer("merge_enriched")
+    def merge_enriched(cls,
+                       file_paths: List[str],
+                       save_path: str) -> None:
+        """ Merge files enriched from the same Edoc file into one file.
+
+        The files must contain the same items in the same order. Fields of later files override fields of earlier files
+        except for dictionaries such as the Annif component, which are merged.
+
+        :param file_paths: complete paths to files including filename and extension
+        :param save_path: complete path to save folder including filename and extension
+        """
+
+        merged = None
+        for file_path in file_paths:
+            data = Utility.load_json(file_path)
+            if merged is None:
+                merged = data
+                continue
+
+            assert(len(data) == len(merged))
 
-        file_path = DIR + "/indexed/indexed_master.json"
-        save_path = f"{DIR}/indexed/indexed_working_{str(datetime.now()).split('.')[0].replace(':', '-').replace(' ', '-')}.json"
-        project_ids = ["yso-en", "yso-maui-en", "yso-bonsai-en", "yso-fasttext-en", "wikidata-en"]
+            for merged_item, item in zip(merged, data):
+                for field, value in item.items():
+                    if isinstance(value, dict) and isinstance(merged_item.get(field), dict):
+                        merged_item[field] = dict(merged_item.get(field), **value)
+                    else:
+                        merged_item[field] = value
 
-        Data.enrich_with_annif(file_path=file_path, save_path=save_path, project_ids=project_ids, abstract=abstract)
+        Monitor.count("merge_enriched", len(merged))
+        Utility.save_json(merged, save_path)
 
     @classmethod
     def get_departments(cls) -> List[str]:
@@ -444,19 +1676,25 @@ class Keywords:
         return openrefine_histogram
 
     @classmethod
+    @Monitor.timer("enrich_with_yso")
     def enrich_with_yso(cls,
                         file_path: str,
                         save_path: str):
         """ Enrich items in file with YSO IDs if available.
 
+        The YSO ID of each distinct clean keyword is fetched once, concurrently via Http.
+
         :param file_path: complete path to file including filename and extension
         :param save_path: complete path to save folder including filename without extension
         """
 
         data = Utility.load_json(file_path)
         modified_data = []
+        fetches = []
 
         for item in data:
+            Monitor.count("enrich_with_yso")
+
             # make deep copy of item:
             modified_item = dict(item)
 
@@ -465,12 +1703,16 @@ class Keywords:
                 if modified_item.get("keyword clean") == "":
                     continue
                 else:
-                    yso = cls.fetch_yso(modified_item.get("keyword clean"))
-                    modified_item["yso id"] = yso
-                    print(yso)
+                    fetches.append(modified_item)
 
             modified_data.append(modified_item)
 
+        keywords_per_item, distinct = Planner.plan("finto", fetches, lambda item: [item.get("keyword clean")])
+        ysos = Planner.resolve(distinct, Http.gather(cls.fetch_yso_async(keyword) for keyword in distinct))
+        for modified_item, keywords in zip(fetches, keywords_per_item):
+            modified_item["yso id"] = ysos[keywords[0]]
+            print(modified_item["yso id"])
+
         Utility.save_json(modified_data, save_path)
 
     @classmethod
@@ -481,12 +1723,22 @@ class Keywords:
         :param keyword: the keyword
         """
 
-        http = urllib3.PoolManager()
-        url = f"https://api.finto.fi/rest/v1/yso/search?query={keyword}&lang=en"
-        response = http.request('GET', url)
+        return Http.run(cls.fetch_yso_async(keyword))
+
+    @classmethod
+    async def fetch_yso_async(cls,
+                              keyword: str) -> Union[str, None]:
+        """ Fetch the YSO ID for a keyword if any via Http.
+
+        :param keyword: the keyword
+        """
+
+        url = "https://api.finto.fi/rest/v1/yso/search"
+        with Monitor.timer("finto", latency=True):
+            data = await Http.request("GET", url, {"query": keyword, "lang": "en"})
 
         try:
-            results = ast.literal_eval(response.data.decode("UTF-8")).get("results")
+            results = ast.literal_eval(data.decode("UTF-8")).get("results")
             return results[0].get("localname")[1:]
         except (IndexError, SyntaxError):
             return None
@@ -504,29 +1756,1258 @@ class Keywords:
         data = Utility.load_json(file_path)
         output = []
 
-        for item in data:
-            gold_standard = item.get("keywords enriched")
-            qid = 0
-            mesh = 0
-            yso = 0
-            try:
-                for keyword in gold_standard:
-                    if keyword.get("qid") != "":
-                        qid = qid + 1
-                    if keyword.get("mesh id") != "":
-                        mesh = mesh + 1
-                    if keyword.get("yso id") != "":
-                        yso = yso + 1
-                output.append({"gold standard": len(gold_standard), "qid": qid, "mesh id": mesh, "yso id": yso})
-            except AttributeError:
-                continue
+        for item in data:
+            gold_standard = item.get("keywords enriched")
+            qid = 0
+            mesh = 0
+            yso = 0
+            try:
+                for keyword in gold_standard:
+                    if keyword.get("qid") != "":
+                        qid = qid + 1
+                    if keyword.get("mesh id") != "":
+                        mesh = mesh + 1
+                    if keyword.get("yso id") != "":
+                        yso = yso + 1
+                output.append({"gold standard": len(gold_standard), "qid": qid, "mesh id": mesh, "yso id": yso})
+            except AttributeError:
+                continue
+
+        Utility.save_json(output, save_path)
+
+
+class Refine:
+    """ Replay an OpenRefine operation history natively to regenerate the keyword reference.
+
+    The history in /keywords/operation_history.json records how keywords_reference.json was made from the keyword
+    histogram in OpenRefine. Rows are replayed in batches on parallel worker processes and spooled to disk between
+    passes, so that only a few batches are in memory at a time. Operations that need all rows, such as row reordering
+    and facetCount facets, run between passes. Reconciliation and data extension look up a local vocabulary instead of
+    the Wikidata reconciliation service. The vocabulary is built by make_vocabulary from Wikidata, MeSH and YSO label
+    dumps and is independent of the keyword reference; validate checks it against the reference. Operations with
+    unsupported facets or expressions are skipped with a warning.
+    """
+
+    batch_size = 1000
+    # Wikidata property: (column name, vocabulary field), None if the vocabulary has no data for the property:
+    properties = {"qid": ("Qid", "qid"),
+                  "P486": ("MeSH descriptor ID", "mesh id"),
+                  "P2347": ("YSO ID", "yso id"),
+                  "P31": ("instance of", None),
+                  "P2308": ("class", None)}
+    # histogram fields spelled as in the OpenRefine project the history was recorded on:
+    column_aliases = {"occurrences": "occurences"}
+    # Jython expressions of the history by their body, each mapped to a native handler of the cell value:
+    jython_expressions = {'if value is None:\n return None\nif "studies" in value:\n'
+                          ' return value.replace("studies", "study")\nelse:\n return value.rstrip("s")': "singularize"}
+    vocabularies = dict()
+    expressions = dict()
+
+    @classmethod
+    def load_wikidata_labels(cls,
+                             file_path: str) -> Dict[str, Dict]:
+        """ Load Wikidata items with their English labels, MeSH descriptor ID and YSO ID by QID.
+
+        The file is a JSON result of the Wikidata Query Service with the variables item, itemLabel and optionally
+        altLabel, mesh and yso, for example of:
+        SELECT ?item ?itemLabel ?altLabel ?mesh ?yso WHERE { ?item wdt:P486|wdt:P2347 [].
+        OPTIONAL { ?item wdt:P486 ?mesh } OPTIONAL { ?item wdt:P2347 ?yso }
+        OPTIONAL { ?item skos:altLabel ?altLabel FILTER(LANG(?altLabel) = "en") }
+        SERVICE wikibase:label { bd:serviceParam wikibase:language "en" } }
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        with open(file_path, encoding="utf-8") as file:
+            bindings = load(file).get("results").get("bindings")
+
+        entries = dict()
+        for binding in bindings:
+            values = {variable: value.get("value") for variable, value in binding.items()}
+            qid = values.get("item", "").split("/")[-1]
+            if re.fullmatch(r"Q\d+", qid) is None:
+                continue
+            entry = entries.setdefault(qid, {"qid": qid, "wikidata label": "", "labels": [], "mesh id": "",
+                                              "yso id": ""})
+            # the label service returns the QID if there is no English label:
+            if values.get("itemLabel") not in [None, qid]:
+                entry["wikidata label"] = values.get("itemLabel")
+            if values.get("altLabel") not in [None, ""] and values.get("altLabel") not in entry["labels"]:
+                entry["labels"].append(values.get("altLabel"))
+            if entry["mesh id"] == "" and values.get("mesh") is not None:
+                entry["mesh id"] = values.get("mesh")
+            if entry["yso id"] == "" and values.get("yso", "").isdigit():
+                entry["yso id"] = int(values.get("yso"))
+
+        return entries
+
+    @classmethod
+    def load_mesh_labels(cls,
+                         file_path: str) -> Dict[str, List[str]]:
+        """ Load the descriptor name and entry terms of each MeSH descriptor by descriptor ID.
+
+        The file is a MeSH descriptor XML file as published by the NLM, for example desc2021.xml.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        from xml.etree.ElementTree import iterparse
+
+        labels = dict()
+        for _, element in iterparse(file_path):
+            if element.tag != "DescriptorRecord":
+                continue
+            names = [element.findtext("DescriptorName/String")]
+            names = names + [term.text for term in element.iterfind("ConceptList/Concept/TermList/Term/String")]
+            labels[element.findtext("DescriptorUI")] = list(dict.fromkeys(name for name in names if name))
+            element.clear()
+
+        return labels
+
+    @classmethod
+    def load_yso_labels(cls,
+                        file_path: str,
+                        language: str = "en") -> Dict[int, List[str]]:
+        """ Load the preferred and alternative labels of each YSO concept by YSO ID.
+
+        The file is the YSO SKOS vocabulary as N-Triples, for example converted from the Finto download yso-skos.ttl.
+
+        :param file_path: complete path to file including filename and extension
+        :param language: language of the labels, defaults to en
+        """
+
+        pattern = re.compile(r'<http://www\.yso\.fi/onto/yso/p(\d+)> <http://www\.w3\.org/2004/02/skos/core#'
+                             r'(?:prefLabel|altLabel)> "((?:[^"\\]|\\.)*)"@' + re.escape(language) + r' \.')
+
+        labels = dict()
+        with open(file_path, encoding="utf-8") as file:
+            for line in file:
+                match = pattern.match(line)
+                if match is not None:
+                    label = loads(f'"{match.group(2)}"')
+                    if label not in labels.setdefault(int(match.group(1)), []):
+                        labels[int(match.group(1))].append(label)
+
+        return labels
+
+    @classmethod
+    def make_vocabulary(cls,
+                        wikidata_path: str,
+                        save_path: str = None,
+                        mesh_path: str = None,
+                        yso_path: str = None) -> int:
+        """ Make the local vocabulary from label dumps, save it and return the number of entries.
+
+        Each entry is a Wikidata item with its QID, Wikidata label, MeSH descriptor ID and YSO ID as in
+        load_wikidata_labels. Its labels are the English alternative labels and, if given, the MeSH labels of its
+        descriptor and the YSO labels of its concept. The output is saved as /keywords/vocabulary.json.
+
+        :param wikidata_path: complete path to Wikidata labels including filename and extension, see
+            load_wikidata_labels
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /keywords/vocabulary.json
+        :param mesh_path: complete path to MeSH descriptors including filename and extension, defaults to None
+        :param yso_path: complete path to YSO N-Triples including filename and extension, defaults to None
+        """
+
+        if save_path is None:
+            save_path = DIR + "/keywords/vocabulary.json"
+
+        entries = cls.load_wikidata_labels(wikidata_path)
+        for path, loader, field in [(mesh_path, cls.load_mesh_labels, "mesh id"),
+                                    (yso_path, cls.load_yso_labels, "yso id")]:
+            if path is None:
+                continue
+            labels = loader(path)
+            for entry in entries.values():
+                for label in labels.get(entry.get(field), []):
+                    if label not in entry["labels"]:
+                        entry["labels"].append(label)
+
+        vocabulary = list(entries.values())
+        Utility.save_json(vocabulary, save_path)
+        print(f"{len(vocabulary)} vocabulary entries saved")
+
+        return len(vocabulary)
+
+    @classmethod
+    def get_vocabulary(cls,
+                       file_path: str) -> Dict[str, Dict]:
+        """ Get the local vocabulary of make_vocabulary: candidates by normalized label and entries by QID.
+
+        The labels of an entry are its Wikidata label and its other labels. The file is loaded once per process and
+        loaded again only if it changes.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        modified = os.path.getmtime(file_path)
+        cached = cls.vocabularies.get(file_path)
+        Monitor.cache("vocabulary", cached is not None and cached[0] == modified)
+
+        if cached is None or cached[0] != modified:
+            labels = dict()
+            entries = dict()
+            for entry in Utility.load_json(file_path):
+                qid = entry.get("qid")
+                if qid in [None, ""]:
+                    continue
+                entries.setdefault(qid, entry)
+                for value in [entry.get("wikidata label")] + entry.get("labels", []):
+                    label = cls.normalize(value)
+                    if label != "":
+                        labels.setdefault(label, dict()).setdefault(qid, entry.get("wikidata label") or value)
+            candidates = {label: [{"id": qid, "name": name, "score": 100} for qid, name in names.items()]
+                          for label, names in labels.items()}
+            cls.vocabularies[file_path] = (modified, {"candidates": candidates, "entries": entries})
+
+        return cls.vocabularies[file_path][1]
+
+    @classmethod
+    def normalize(cls,
+                  value) -> str:
+        """ Normalize a cell value for lookup in the vocabulary.
+
+        :param value: the cell value
+        """
+
+        if value is None:
+            return ""
+
+        return " ".join(str(value).lower().split())
+
+    @classmethod
+    def get_expression(cls,
+                       expression: str) -> Callable:
+        """ Get a function that evaluates a GREL or Jython expression on a row.
+
+        The function takes the row, the column name and the context with facet counts. Supported are the GREL and
+        Jython expressions in the keyword history; Jython is not run but mapped to a handler by jython_expressions.
+
+        :param expression: the expression
+        """
+
+        if expression in cls.expressions:
+            return cls.expressions[expression]
+
+        source = expression[len("grel:"):] if expression.startswith("grel:") else expression
+        judgment = 'forNonBlank(cell.recon.judgment, v, v, if(isNonBlank(value), "(unreconciled)", "(blank)"))'
+        cells = re.fullmatch(r'cells\["(.+)"\]\.value', source)
+        facet_count = re.fullmatch(r"facetCount\(value, 'value', '(.+)'\) > 1", source)
+
+        def get_recon(row, column):
+            return row["recon"].get(column) or dict()
+
+        def get_best_score(row, column):
+            scores = [candidate.get("score") for candidate in get_recon(row, column).get("candidates", [])]
+            return max(scores) if len(scores) > 0 else None
+
+        def get_judgment(row, column):
+            if get_recon(row, column).get("judgment") is not None:
+                return get_recon(row, column).get("judgment")
+            return "(blank)" if row["cells"].get(column) in [None, ""] else "(unreconciled)"
+
+        if expression.startswith("jython:"):
+            handler = cls.jython_expressions.get(expression[len("jython:"):].strip())
+            if handler is None:
+                raise ValueError(f"unsupported Jython expression {expression}")
+            handler = getattr(cls, handler)
+            function = lambda row, column, context: handler(row["cells"].get(column))
+        elif source == "value":
+            function = lambda row, column, context: row["cells"].get(column)
+        elif source == "null":
+            function = lambda row, column, context: None
+        elif source == "isNull(value)":
+            function = lambda row, column, context: row["cells"].get(column) is None
+        elif source == "row.flagged":
+            function = lambda row, column, context: row["flagged"]
+        elif source == "cell.recon.match.id":
+            function = lambda row, column, context: (get_recon(row, column).get("match") or dict()).get("id")
+        elif source == "cell.recon.best.score":
+            function = get_best_score
+        elif source == "cell.recon.judgmentAction":
+            function = lambda row, column, context: get_recon(row, column).get("action")
+        elif source == judgment:
+            function = lambda row, column, context: get_judgment(row, column)
+        elif cells is not None:
+            function = lambda row, column, context: row["cells"].get(cells.group(1))
+        elif facet_count is not None:
+            function = lambda row, column, context: \
+                context["counts"][facet_count.group(1)].get(dumps(row["cells"].get(facet_count.group(1))), 0) > 1
+        else:
+            raise ValueError(f"unsupported expression {expression}")
+
+        cls.expressions[expression] = function
+
+        return function
+
+    @classmethod
+    def singularize(cls,
+                    value: Union[str, None]) -> Union[str, None]:
+        """ Make a keyword singular as the Jython expression of the history: "studies" becomes "study", otherwise
+        trailing s are removed.
+
+        :param value: the cell value
+        """
+
+        if value is None:
+            return None
+        if "studies" in value:
+            return value.replace("studies", "study")
+
+        return value.rstrip("s")
+
+    @classmethod
+    def get_facet(cls,
+                  facet: Dict) -> Callable:
+        """ Get a function that checks if a row is selected by an OpenRefine list, range or text facet.
+
+        :param facet: the facet
+        """
+
+        column = facet.get("columnName")
+
+        if facet.get("type") == "text":
+            query = facet.get("query") or ""
+            if facet.get("caseSensitive") is not True:
+                query = query.lower()
+
+            def select(row, context):
+                value = row["cells"].get(column)
+                if value in [None, ""]:
+                    return False
+                value = str(value) if facet.get("caseSensitive") is True else str(value).lower()
+                if facet.get("mode") == "regex":
+                    return re.search(query, value) is not None
+                return query in value
+
+            if query == "":
+                return lambda row, context: True
+            if facet.get("invert") is True:
+                return lambda row, context: not select(row, context)
+            return select
+
+        expression = cls.get_expression(facet.get("expression"))
+
+        if facet.get("type") == "list":
+            values = [choice["v"]["v"] for choice in facet.get("selection")]
+            if len(values) == 0 and facet.get("selectBlank") is not True and facet.get("selectError") is not True:
+                return lambda row, context: True
+
+            def select(row, context):
+                try:
+                    value = expression(row, column, context)
+                except Exception:
+                    return facet.get("selectError") is True
+                if value in [None, ""]:
+                    return facet.get("selectBlank") is True
+                return value in values or str(value) in [str(choice) for choice in values]
+
+            if facet.get("invert") is True:
+                return lambda row, context: not select(row, context)
+            return select
+
+        if facet.get("type") == "range":
+            def select(row, context):
+                try:
+                    value = expression(row, column, context)
+                except Exception:
+                    return facet.get("selectError") is True
+                if value in [None, ""]:
+                    return facet.get("selectBlank") is True
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    return facet.get("selectNonNumeric") is True
+                return facet.get("selectNumeric") is True and facet.get("from") <= value < facet.get("to")
+
+            return select
+
+        raise ValueError(f"unsupported facet type {facet.get('type')}")
+
+    @classmethod
+    def get_engine(cls,
+                   operation: Dict) -> Callable:
+        """ Get a function that checks if a row is selected by all facets of an operation.
+
+        :param operation: the operation
+        """
+
+        facets = [cls.get_facet(facet) for facet in operation.get("engineConfig", dict()).get("facets", [])]
+
+        return lambda row, context: all(facet(row, context) for facet in facets)
+
+    @classmethod
+    def get_sort_key(cls,
+                     criteria: List[Dict]) -> Callable:
+        """ Get the sort key of a row for OpenRefine sorting criteria.
+
+        :param criteria: the sorting criteria
+        """
+
+        def get_key(row):
+            key = []
+            for criterion in criteria:
+                value = row["cells"].get(criterion.get("column"))
+                if value in [None, ""]:
+                    key.append((criterion.get("blankPosition", 2), ()))
+                    continue
+                if criterion.get("valueType") == "number":
+                    try:
+                        value = float(value)
+                    except (TypeError, ValueError):
+                        key.append((criterion.get("errorPosition", 1), ()))
+                        continue
+                    key.append((0, (-value if criterion.get("reverse") is True else value,)))
+                else:
+                    value = str(value) if criterion.get("caseSensitive") is True else str(value).lower()
+                    if criterion.get("reverse") is True:
+                        key.append((0, (tuple(-ord(character) for character in value) + (0,),)))
+                    else:
+                        key.append((0, (value,)))
+            return key
+
+        return get_key
+
+    @classmethod
+    def compile(cls,
+                operations: List[Dict],
+                columns: List[str]) -> Tuple[List[Dict], List[str]]:
+        """ Check the operations, resolve their column names and return the supported ones with the final columns.
+
+        Unsupported operations, operations on missing columns and extensions without local data are reported.
+
+        :param operations: the OpenRefine operations
+        :param columns: the columns before the first operation
+        """
+
+        columns = list(columns)
+        steps = []
+        for position, operation in enumerate(operations):
+            kind = operation.get("op", "").replace("core/", "")
+            try:
+                cls.get_engine(operation)
+                for field in ["expression"]:
+                    if field in operation:
+                        cls.get_expression(operation.get(field))
+                required = [operation.get(field) for field in ["columnName", "baseColumnName", "oldColumnName"]
+                            if field in operation]
+                required = required + [criterion.get("column")
+                                       for criterion in operation.get("sorting", dict()).get("criteria", [])]
+                for column in required:
+                    if column not in columns:
+                        raise ValueError(f"unknown column {column}")
+
+                step = dict(operation, kind=kind)
+                if kind == "column-addition":
+                    columns.insert(operation.get("columnInsertIndex"), operation.get("newColumnName"))
+                elif kind == "column-rename":
+                    columns[columns.index(operation.get("oldColumnName"))] = operation.get("newColumnName")
+                elif kind == "column-move":
+                    columns.remove(operation.get("columnName"))
+                    columns.insert(operation.get("index"), operation.get("columnName"))
+                elif kind == "column-removal":
+                    columns.remove(operation.get("columnName"))
+                elif kind == "extend-reconciled-data":
+                    step["columns"] = []
+                    for offset, extension in enumerate(operation.get("extension").get("properties")):
+                        name, field = cls.properties.get(extension.get("id"), (extension.get("id"), None))
+                        if field is None:
+                            print(f"Warning: no local data for {extension.get('id')} ({name}) in operation "
+                                  f"#{position}, column left blank")
+                        column = name
+                        number = 2
+                        while column in columns:
+                            column = f"{name}{number}"
+                            number = number + 1
+                        columns.insert(operation.get("columnInsertIndex") + offset, column)
+                        step["columns"].append((column, field))
+                elif kind not in ["recon", "recon-judge-similar-cells", "recon-clear-similar-cells",
+                                  "recon-discard-judgments", "recon-match-best-candidates", "row-removal", "row-flag",
+                                  "row-reorder", "text-transform"]:
+                    raise ValueError(f"unsupported operation {kind}")
+            except (ValueError, SyntaxError) as error:
+                print(f"Warning: skipping operation #{position} {kind}: {error}")
+                Monitor.count("refine skipped")
+                continue
+
+            steps.append(step)
+
+        return steps, columns
+
+    @classmethod
+    def reconcile(cls,
+                  value,
+                  vocabulary: Dict[str, Dict],
+                  limit: int = 0,
+                  auto_match: bool = True) -> Union[Dict, None]:
+        """ Reconcile a cell value against the local vocabulary.
+
+        The value is matched automatically if exactly one vocabulary entry has the value as label.
+
+        :param value: the cell value
+        :param vocabulary: the vocabulary of get_vocabulary
+        :param limit: maximum number of candidates kept, 0 for all, defaults to 0
+        :param auto_match: toggle match unique candidates, defaults to True
+        """
+
+        if value in [None, ""]:
+            return None
+
+        candidates = vocabulary.get("candidates").get(cls.normalize(value), [])
+        recon = {"judgment": "none", "action": "unknown", "match": None,
+                 "candidates": candidates[:limit] if limit > 0 else list(candidates)}
+        if auto_match is True and len(candidates) == 1:
+            recon.update({"judgment": "matched", "action": "auto", "match": dict(candidates[0])})
+
+        return recon
+
+    @classmethod
+    def apply(cls,
+              rows: List[Dict],
+              steps: List[Dict],
+              context: Dict,
+              vocabulary: Dict[str, Dict]) -> List[Dict]:
+        """ Apply row-local operations to rows.
+
+        :param rows: the rows with cells, recon data per column and flag
+        :param steps: the compiled operations
+        :param context: facet counts of the rows of all batches
+        :param vocabulary: the vocabulary of get_vocabulary
+        """
+
+        # rows by cell value for runs of similar-cells operations, which only change recon data:
+        similar = None
+
+        for step in steps:
+            kind = step.get("kind")
+            engine = cls.get_engine(step)
+            column = step.get("columnName")
+
+            if kind in ["recon-judge-similar-cells", "recon-clear-similar-cells"]:
+                if similar is None or similar[0] != column:
+                    similar = (column, dict())
+                    for row in rows:
+                        similar[1].setdefault(row["cells"].get(column), []).append(row)
+                for row in similar[1].get(step.get("similarValue"), []):
+                    if not engine(row, context):
+                        continue
+                    if kind == "recon-clear-similar-cells":
+                        row["recon"].pop(column, None)
+                        continue
+                    recon = row["recon"].setdefault(column, {"candidates": []})
+                    match = step.get("match")
+                    recon.update({"judgment": step.get("judgment"), "action": "similar",
+                                  "match": {"id": match.get("id"), "name": match.get("name")} if match else None})
+                continue
+            similar = None
+
+            if kind in ["column-addition", "text-transform"]:
+                expression = cls.get_expression(step.get("expression"))
+                source = step.get("baseColumnName", column)
+                for row in rows:
+                    original = row["cells"].get(source)
+                    if not engine(row, context):
+                        if kind == "column-addition":
+                            row["cells"][step.get("newColumnName")] = None
+                        continue
+                    try:
+                        value = expression(row, source, context)
+                    except Exception:
+                        value = original if step.get("onError") == "keep-original" else None
+                    row["cells"][step.get("newColumnName", column)] = value
+            elif kind == "column-rename":
+                for row in rows:
+                    for part in ["cells", "recon"]:
+                        if step.get("oldColumnName") in row[part]:
+                            row[part][step.get("newColumnName")] = row[part].pop(step.get("oldColumnName"))
+            elif kind == "column-removal":
+                for row in rows:
+                    row["cells"].pop(column, None)
+                    row["recon"].pop(column, None)
+            elif kind == "recon":
+                config = step.get("config")
+                for row in rows:
+                    if engine(row, context):
+                        recon = cls.reconcile(row["cells"].get(column), vocabulary, limit=config.get("limit", 0),
+                                              auto_match=config.get("autoMatch", True))
+                        row["recon"][column] = recon
+                        if recon is None:
+                            row["recon"].pop(column)
+            elif kind == "recon-discard-judgments":
+                for row in rows:
+                    if column in row["recon"] and engine(row, context):
+                        if step.get("clearData") is True:
+                            row["recon"].pop(column)
+                        else:
+                            row["recon"][column].update({"judgment": "none", "action": "mass", "match": None})
+            elif kind == "recon-match-best-candidates":
+                for row in rows:
+                    recon = row["recon"].get(column)
+                    if recon is not None and len(recon.get("candidates")) > 0 and engine(row, context):
+                        best = max(recon.get("candidates"), key=lambda candidate: candidate.get("score"))
+                        recon.update({"judgment": "matched", "action": "mass", "match": dict(best)})
+            elif kind == "extend-reconciled-data":
+                for row in rows:
+                    match = (row["recon"].get(step.get("baseColumnName")) or dict()).get("match")
+                    entry = None
+                    if match is not None and row["recon"][step.get("baseColumnName")].get("judgment") == "matched" \
+                            and engine(row, context):
+                        entry = vocabulary.get("entries").get(match.get("id"))
+                    for extended, field in step.get("columns"):
+                        value = entry.get(field) if entry is not None and field is not None else None
+                        row["cells"][extended] = None if value == "" else value
+            elif kind == "row-removal":
+                rows = [row for row in rows if not engine(row, context)]
+            elif kind == "row-flag":
+                for row in rows:
+                    if engine(row, context):
+                        row["flagged"] = step.get("flagged")
+
+        return rows
+
+    @classmethod
+    def apply_batch(cls,
+                    lines: List[str],
+                    steps: List[Dict],
+                    context: Dict,
+                    vocabulary_path: str) -> List[str]:
+        """ Apply row-local operations to a batch of spooled rows; run by the worker processes.
+
+        :param lines: the rows as JSON lines
+        :param steps: the compiled operations
+        :param context: facet counts of the rows of all batches
+        :param vocabulary_path: complete path to vocabulary file including filename and extension
+        """
+
+        rows = cls.apply([loads(line) for line in lines], steps, context, cls.get_vocabulary(vocabulary_path))
+
+        return [dumps(row, ensure_ascii=False) + "\n" for row in rows]
+
+    @classmethod
+    def read_batches(cls,
+                     spool_path: str) -> Iterator[List[str]]:
+        """ Read spooled rows in batches of batch_size JSON lines.
+
+        :param spool_path: complete path to spool file including filename and extension
+        """
+
+        batch = []
+        with open(spool_path, encoding="utf-8") as spool:
+            for line in spool:
+                batch.append(line)
+                if len(batch) == cls.batch_size:
+                    yield batch
+                    batch = []
+        if len(batch) > 0:
+            yield batch
+
+    @classmethod
+    def process(cls,
+                spool_path: str,
+                save_path: str,
+                steps: List[Dict],
+                context: Dict,
+                vocabulary_path: str,
+                executor: ProcessPoolExecutor = None,
+                workers: int = 1) -> None:
+        """ Apply row-local operations to spooled rows batch by batch and spool the results in order.
+
+        At most two batches per worker are in flight at a time.
+
+        :param spool_path: complete path to spool file including filename and extension
+        :param save_path: complete path to save spool file including filename and extension
+        :param steps: the compiled operations
+        :param context: facet counts of the rows of all batches
+        :param vocabulary_path: complete path to vocabulary file including filename and extension
+        :param executor: the worker processes, defaults to None for running in this process
+        :param workers: number of worker processes, defaults to 1
+        """
+
+        with open(save_path, "w", encoding="utf-8") as spool:
+            pending = []
+            for lines in cls.read_batches(spool_path):
+                if executor is None:
+                    spool.writelines(cls.apply_batch(lines, steps, context, vocabulary_path))
+                    continue
+                pending.append(executor.submit(cls.apply_batch, lines, steps, context, vocabulary_path))
+                if len(pending) >= 2 * workers:
+                    spool.writelines(pending.pop(0).result())
+            for future in pending:
+                spool.writelines(future.result())
+
+    @classmethod
+    def sort(cls,
+             spool_path: str,
+             save_path: str,
+             criteria: List[Dict]) -> None:
+        """ Sort spooled rows by sorting each batch and merging the sorted batches.
+
+        :param spool_path: complete path to spool file including filename and extension
+        :param save_path: complete path to save spool file including filename and extension
+        :param criteria: the sorting criteria
+        """
+
+        import heapq
+
+        get_key = cls.get_sort_key(criteria)
+        run_paths = []
+        for lines in cls.read_batches(spool_path):
+            run_paths.append(f"{save_path}.{len(run_paths)}")
+            with open(run_paths[-1], "w", encoding="utf-8") as run:
+                run.writelines(sorted(lines, key=lambda line: get_key(loads(line))))
+
+        runs = [open(run_path, encoding="utf-8") for run_path in run_paths]
+        try:
+            with open(save_path, "w", encoding="utf-8") as spool:
+                spool.writelines(heapq.merge(*runs, key=lambda line: get_key(loads(line))))
+        finally:
+            for run, run_path in zip(runs, run_paths):
+                run.close()
+                os.remove(run_path)
+
+    @classmethod
+    def count_values(cls,
+                     spool_path: str,
+                     columns: List[str]) -> Dict[str, Dict[str, int]]:
+        """ Count the cell values of columns over all spooled rows for facetCount.
+
+        :param spool_path: complete path to spool file including filename and extension
+        :param columns: the columns
+        """
+
+        counts = {column: dict() for column in columns}
+        for lines in cls.read_batches(spool_path):
+            for line in lines:
+                row = loads(line)
+                for column in columns:
+                    value = dumps(row["cells"].get(column))
+                    counts[column][value] = counts[column].get(value, 0) + 1
+
+        return counts
+
+    @classmethod
+    @Monitor.timer("replay")
+    def replay(cls,
+               vocabulary_path: str,
+               history_path: str = None,
+               histogram_path: str = None,
+               save_path: str = None,
+               workers: int = 4) -> int:
+        """ Replay the OpenRefine history on a keyword histogram, save the reference keywords and return their number.
+
+        For example: replay(DIR + "/keywords/vocabulary.json",
+        save_path=DIR + "/keywords/keywords_reference_replayed.json")
+
+        Each histogram entry is a row with one column per field, named as in OpenRefine, for example "_ - keyword".
+        Reconciled cells are saved with the label of their match.
+
+        :param vocabulary_path: complete path to vocabulary of make_vocabulary including filename and extension
+        :param history_path: complete path to OpenRefine history including filename and extension, defaults to
+            /keywords/operation_history.json
+        :param histogram_path: complete path to keyword histogram including filename and extension, defaults to
+            /keywords/keywords_clean_histogram.json
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /keywords/keywords_reference_replayed.json
+        :param workers: number of worker processes, 1 for none, defaults to 4
+        """
+
+        import tempfile
+        from concurrent.futures import ProcessPoolExecutor
+
+        if history_path is None:
+            history_path = DIR + "/keywords/operation_history.json"
+        if histogram_path is None:
+            histogram_path = DIR + "/keywords/keywords_clean_histogram.json"
+        if save_path is None:
+            save_path = DIR + "/keywords/keywords_reference_replayed.json"
+        if os.path.abspath(vocabulary_path) == os.path.abspath(save_path):
+            raise ValueError("The vocabulary must not be the output of the replay")
+
+        with tempfile.TemporaryDirectory() as work_path:
+            # spool the histogram as rows:
+            spool_path = work_path + "/rows_0.jsonl"
+            columns = []
+            with open(spool_path, "w", encoding="utf-8") as spool:
+                for _, _, item in Selection.stream(histogram_path):
+                    cells = {f"_ - {cls.column_aliases.get(field, field)}": value for field, value in item.items()}
+                    columns = columns or list(cells)
+                    spool.write(dumps({"cells": cells, "recon": dict(), "flagged": False}, ensure_ascii=False) + "\n")
+
+            steps, columns = cls.compile(Utility.load_json(history_path), columns)
+
+            # split the operations into passes at operations that need all rows:
+            passes = [[]]
+            for step in steps:
+                needs_counts = "facetCount(" in dumps(step.get("engineConfig", dict()))
+                if step.get("kind") == "row-reorder" or needs_counts:
+                    passes.append([])
+                passes[-1].append(step)
+                if step.get("kind") == "row-reorder":
+                    passes.append([])
+
+            executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            try:
+                for number, steps in enumerate([steps for steps in passes if len(steps) > 0]):
+                    save_spool_path = work_path + f"/rows_{number + 1}.jsonl"
+                    if steps[0].get("kind") == "row-reorder":
+                        cls.sort(spool_path, save_spool_path, steps[0].get("sorting").get("criteria"))
+                    else:
+                        counted = re.findall(r"facetCount\(value, 'value', '(.+?)'\)",
+                                             dumps([step.get("engineConfig", dict()) for step in steps]))
+                        context = {"counts": cls.count_values(spool_path, sorted(set(counted)))}
+                        cls.process(spool_path, save_spool_path, steps, context, vocabulary_path,
+                                    executor=executor, workers=workers)
+                    os.remove(spool_path)
+                    spool_path = save_spool_path
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+
+            # save the rows as JSON list, with the label of the match for reconciled cells:
+            number = 0
+            with open(save_path, "w", encoding="utf-8") as file:
+                file.write("[")
+                for lines in cls.read_batches(spool_path):
+                    for line in lines:
+                        row = loads(line)
+                        item = dict()
+                        for column in columns:
+                            value = row["cells"].get(column)
+                            match = (row["recon"].get(column) or dict()).get("match")
+                            if match is not None and row["recon"][column].get("judgment") == "matched":
+                                value = match.get("name")
+                            item[column] = "" if value is None else value
+                        file.write((", " if number > 0 else "") + dumps(item))
+                        number = number + 1
+                file.write("]")
+
+        Monitor.count("replay", number)
+        print(f"{number} reference keywords saved")
+
+        return number
+
+    @classmethod
+    def validate(cls,
+                 vocabulary_path: str,
+                 reference_path: str = None,
+                 save_path: str = None) -> Dict:
+        """ Validate the reconciliation against the local vocabulary on reference keywords held out from it.
+
+        Each distinct clean keyword of the reference with a QID is reconciled as by the recon operation. Precision is
+        the share of automatic matches with the QID of the reference, recall the share of keywords matched to it and
+        candidate recall the share of keywords with it among the candidates. The output is saved as
+        /analysis/refine_validation.json.
+
+        :param vocabulary_path: complete path to vocabulary of make_vocabulary including filename and extension
+        :param reference_path: complete path to reference keywords including filename and extension, defaults to
+            /keywords/keywords_reference_master.json
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /analysis/refine_validation.json
+        """
+
+        if reference_path is None:
+            reference_path = DIR + "/keywords/keywords_reference_master.json"
+        if save_path is None:
+            save_path = DIR + "/analysis/refine_validation.json"
+        if os.path.abspath(vocabulary_path) == os.path.abspath(reference_path):
+            raise ValueError("The vocabulary must be held out from the reference it is validated against")
+
+        vocabulary = cls.get_vocabulary(vocabulary_path)
+
+        expected = dict()
+        for entry in Utility.load_json(reference_path):
+            if entry.get("qid") not in [None, ""] and cls.normalize(entry.get("keyword clean")) != "":
+                expected.setdefault(cls.normalize(entry.get("keyword clean")), entry.get("qid"))
+
+        matched = 0
+        correct = 0
+        candidates = 0
+        for keyword, qid in expected.items():
+            recon = cls.reconcile(keyword, vocabulary)
+            if qid in [candidate.get("id") for candidate in recon.get("candidates")]:
+                candidates = candidates + 1
+            if recon.get("match") is not None:
+                matched = matched + 1
+                if recon.get("match").get("id") == qid:
+                    correct = correct + 1
+
+        results = {"keywords": len(expected),
+                   "matched": matched,
+                   "correct": correct,
+                   "precision": correct / matched if matched > 0 else 0.0,
+                   "recall": correct / len(expected) if len(expected) > 0 else 0.0,
+                   "candidate recall": candidates / len(expected) if len(expected) > 0 else 0.0}
+
+        Utility.save_json(results, save_path)
+        print(f"precision {results['precision']:.3f}, recall {results['recall']:.3f}, "
+              f"candidate recall {results['candidate recall']:.3f} on {len(expected)} keywords")
+
+        return results
+
+
+class LocalAnnif:
+    """ A local stand-in for AnnifClient.
+
+    Suggestions are replayed from items already enriched with Annif if the same project and text were indexed before,
+    and otherwise computed with a TF-IDF model of the reference keywords. Wikidata projects suggest QIDs, all other
+    projects suggest YSO IDs.
+
+    For example: Data.enrich_with_annif(..., client=LocalAnnif(replay_paths=[DIR + "/indexed/indexed_master.json"]))
+    """
+
+    project_ids = ["yso-en", "yso-maui-en", "yso-bonsai-en", "yso-fasttext-en", "wikidata-en"]
+
+    def __init__(self,
+                 reference_path: str = None,
+                 replay_paths: List[str] = None) -> None:
+        """ Build the TF-IDF models and load the responses to be replayed.
+
+        :param reference_path: complete path to reference keywords including filename and extension, defaults to
+            /keywords/keywords_reference_master.json
+        :param replay_paths: complete paths to files enriched with Annif including filename and extension, defaults to
+            None
+        """
+
+        if reference_path is None:
+            reference_path = DIR + "/keywords/keywords_reference_master.json"
+
+        reference = Utility.load_json(reference_path)
+        self.models = {"qid": self.make_model(reference, "qid"),
+                       "yso id": self.make_model(reference, "yso id")}
+
+        self.replay = dict()
+        for replay_path in replay_paths or []:
+            for item in Utility.load_json(replay_path):
+                for name, results in item.get("annif", dict()).items():
+                    # name is project_id-abstract-fulltext-threshold-limit:
+                    project_id, abstract = name.rsplit("-", 4)[:2]
+                    text = item.get("title")
+                    if abstract == "True":
+                        text = text + " " + item.get("abstract")
+                    self.replay[(project_id, text)] = results
+
+    @classmethod
+    def get_tokens(cls,
+                   text: str) -> List[str]:
+        """ Split a text into lower case word tokens.
+
+        :param text: the text
+        """
+
+        return re.findall(r"\w+", text.lower())
+
+    @classmethod
+    def make_model(cls,
+                   reference: List[Dict],
+                   id_type: str) -> Dict:
+        """ Make a TF-IDF model of the reference keywords with an ID of the type.
+
+        Each ID is a document made of its clean keywords and Wikidata labels. The model is an inverted index from
+        tokens to the normalized TF-IDF weight of each document.
+
+        :param reference: the reference keywords
+        :param id_type: qid or yso id
+        """
+
+        documents = dict()
+        labels = dict()
+        for entry in reference:
+            identifier = entry.get(id_type)
+            if identifier in ["", None]:
+                continue
+            if id_type == "qid":
+                uri = f"http://www.wikidata.org/entity/{identifier}"
+            else:
+                uri = f"http://www.yso.fi/onto/yso/p{identifier}"
+            tokens = documents.setdefault(uri, dict())
+            for token in cls.get_tokens(f"{entry.get('keyword clean')} {entry.get('wikidata label')}"):
+                tokens[token] = tokens.get(token, 0) + 1
+            labels.setdefault(uri, entry.get("wikidata label") or entry.get("keyword clean"))
+
+        frequencies = dict()
+        for tokens in documents.values():
+            for token in tokens:
+                frequencies[token] = frequencies.get(token, 0) + 1
+        idf = {token: math.log(len(documents) / frequency) + 1 for token, frequency in frequencies.items()}
+
+        index = dict()
+        for uri, tokens in documents.items():
+            weights = {token: count * idf[token] for token, count in tokens.items()}
+            norm = math.sqrt(sum(weight ** 2 for weight in weights.values()))
+            for token, weight in weights.items():
+                index.setdefault(token, []).append((uri, weight / norm))
+
+        return {"index": index, "idf": idf, "labels": labels}
+
+    @property
+    def projects(self) -> List[Dict]:
+        """ Get the available projects like AnnifClient.projects. """
+
+        return [self.get_project(project_id) for project_id in self.project_ids]
+
+    def get_project(self,
+                    project_id: str) -> Dict:
+        """ Get a project like AnnifClient.get_project.
+
+        :param project_id: Annif-client project ID
+        """
+
+        if project_id not in self.project_ids:
+            raise ValueError(f"Project '{project_id}' not found")
+
+        return {"project_id": project_id, "name": f"{project_id} (local)", "language": "en", "backend": "local"}
+
+    def suggest(self,
+                project_id: str,
+                text: str,
+                limit: int = None,
+                threshold: float = None) -> List[Dict]:
+        """ Suggest subjects for a text like AnnifClient.suggest.
+
+        :param project_id: Annif-client project ID
+        :param text: the text to be indexed
+        :param limit: maximum number of results, defaults to 10
+        :param threshold: minimum score of results, defaults to 0
+        """
+
+        self.get_project(project_id)
+        if limit is None:
+            limit = 10
+        if threshold is None:
+            threshold = 0
+
+        results = self.replay.get((project_id, text))
+        Monitor.cache("local annif replay", results is not None)
+
+        if results is None:
+            model = self.models["qid" if Analysis.get_id_type(project_id) == "qid" else "yso id"]
+
+            query = dict()
+            for token in self.get_tokens(text):
+                if token in model["idf"]:
+                    query[token] = query.get(token, 0) + model["idf"][token]
+            norm = math.sqrt(sum(weight ** 2 for weight in query.values()))
+
+            scores = dict()
+            for token, weight in query.items():
+                for uri, document_weight in model["index"][token]:
+                    scores[uri] = scores.get(uri, 0) + weight / norm * document_weight
+
+            ranked = sorted(scores.items(), key=lambda score: score[1], reverse=True)
+            results = [{"uri": uri, "label": model["labels"][uri], "notation": None, "score": score}
+                       for uri, score in ranked[:limit]]
+
+        return [result for result in results[:limit] if result.get("score") >= threshold]
+
+    def suggest_batch(self,
+                      project_id: str,
+                      documents: List[Dict],
+                      limit: int = None,
+                      threshold: float = None) -> List[Dict]:
+        """ Suggest subjects for a batch of documents like AnnifClient.suggest_batch.
+
+        :param project_id: Annif-client project ID
+        :param documents: the documents, each a dictionary with text and optionally document_id
+        :param limit: maximum number of results per document, defaults to 10
+        :param threshold: minimum score of results, defaults to 0
+        """
+
+        return [{"document_id": document.get("document_id"),
+                 "results": self.suggest(project_id, document.get("text"), limit=limit, threshold=threshold)}
+                for document in documents]
+
+    def serve(self,
+              host: str = "127.0.0.1",
+              port: int = 5000) -> None:
+        """ Serve the Annif REST API endpoints used by AnnifClient until interrupted.
+
+        For example: AnnifClient(api_base="http://127.0.0.1:5000/v1/")
+
+        :param host: the host name, defaults to 127.0.0.1
+        :param port: the port, defaults to 5000
+        """
+
+        from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+        from urllib.parse import urlparse, parse_qs
+        annif = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def respond(self, status: int, body: Union[Dict, List]) -> None:
+                data = dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def route(self, method: str) -> None:
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                parameters = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+                # bad parameters or body are client errors:
+                try:
+                    body = ""
+                    if method == "POST":
+                        body = self.rfile.read(int(self.headers.get("Content-Length", 0))).decode("utf-8")
+                        if not body.startswith("{"):
+                            parameters.update({key: values[0] for key, values in parse_qs(body).items()})
+                    limit = int(parameters["limit"]) if "limit" in parameters else None
+                    threshold = float(parameters["threshold"]) if "threshold" in parameters else None
+                    documents = None
+                    if method == "POST" and len(parts) == 4 and parts[3] == "suggest-batch":
+                        documents = loads(body).get("documents")
+                        if not isinstance(documents, list) or not all(isinstance(document, dict)
+                                                                      for document in documents):
+                            raise ValueError("documents must be a list of objects")
+                except (ValueError, AttributeError) as error:
+                    return self.respond(400, {"detail": f"bad request: {error}"})
+
+                # unknown projects and paths are not found:
+                try:
+                    if method == "GET" and parts == ["v1", "projects"]:
+                        return self.respond(200, {"projects": annif.projects})
+                    elif method == "GET" and len(parts) == 3 and parts[:2] == ["v1", "projects"]:
+                        return self.respond(200, annif.get_project(parts[2]))
+                    elif method == "POST" and len(parts) == 4 and parts[3] == "suggest":
+                        results = annif.suggest(parts[2], parameters.get("text", ""), limit=limit, threshold=threshold)
+                        return self.respond(200, {"results": results})
+                    elif method == "POST" and len(parts) == 4 and parts[3] == "suggest-batch":
+                        results = annif.suggest_batch(parts[2], documents, limit=limit, threshold=threshold)
+                        return self.respond(200, results)
+                    else:
+                        return self.respond(404, {"detail": f"{url.path} not found"})
+                except ValueError as error:
+                    return self.respond(404, {"detail": str(error)})
+
+            def do_GET(self) -> None:
+                self.route("GET")
+
+            def do_POST(self) -> None:
+                self.route("POST")
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        print(f"Serving local Annif at http://{host}:{port}/v1/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+class Sampling:
+    """ A collection of single-pass sampling functions for streamed Edoc items. """
+
+    @classmethod
+    def reservoir(cls,
+                  items: Iterable[Dict],
+                  size: int,
+                  seed: int = None) -> List[Dict]:
+        """ Draw a simple random sample of size items in one pass with reservoir sampling.
+
+        Only the sample is kept in memory. If there are fewer items than size, all items are returned.
+
+        :param items: the items, for example Selection.select(DIR + "/raw", Selection.has())
+        :param size: the sample size
+        :param seed: seed for a reproducible sample, defaults to None
+        """
+
+        generator = random.Random(seed)
+        sample = []
+
+        position = 0
+        for item in items:
+            if position < size:
+                sample.append(item)
+            else:
+                replace = generator.randrange(position + 1)
+                if replace < size:
+                    sample[replace] = item
+            position = position + 1
+
+        generator.shuffle(sample)
+
+        return sample
+
+    @classmethod
+    def stratified(cls,
+                   items: Iterable[Dict],
+                   field: str,
+                   size: int = None,
+                   quotas: Dict[str, int] = None,
+                   seed: int = None) -> Tuple[List[Dict], Dict[str, Dict]]:
+        """ Draw a stratified random sample in one pass and return it together with its distribution per stratum.
+
+        With quotas, each stratum is sampled with its quota and strata without quota are left out. With size, the
+        sample is allocated proportionally to the stratum sizes (largest remainder); this keeps up to size items per
+        stratum in memory until the stratum sizes are known.
+
+        :param items: the items, for example Selection.select(DIR + "/raw", Selection.has())
+        :param field: the field to stratify by, for example department, year or type
+        :param size: the total sample size for proportional allocation, defaults to None
+        :param quotas: the sample size per stratum value, defaults to None
+        :param seed: seed for a reproducible sample, defaults to None
+        """
+
+        if (size is None) == (quotas is None):
+            raise ValueError("Give either a sample size or quotas per stratum")
+
+        generator = random.Random(seed)
+        reservoirs = dict()
+        population = dict()
+
+        for item in items:
+            values = Selection.get_values(item, field)
+            stratum = values[0] if len(values) > 0 else ""
+            seen = population.get(stratum, 0)
+            population[stratum] = seen + 1
+
+            capacity = size if quotas is None else quotas.get(stratum, 0)
+            reservoir = reservoirs.setdefault(stratum, [])
+            if seen < capacity:
+                reservoir.append(item)
+            else:
+                replace = generator.randrange(seen + 1)
+                if replace < capacity:
+                    reservoir[replace] = item
+
+        # allocate the sample to the strata:
+        if quotas is not None:
+            allocation = {stratum: min(quotas.get(stratum, 0), count) for stratum, count in population.items()}
+        else:
+            total = sum(population.values())
+            shares = {stratum: size * count / total for stratum, count in population.items()} if total > 0 else {}
+            allocation = {stratum: int(share) for stratum, share in shares.items()}
+            remainders = sorted(shares, key=lambda stratum: shares[stratum] - allocation[stratum], reverse=True)
+            for stratum in remainders[:min(size, total) - sum(allocation.values())]:
+                allocation[stratum] = allocation[stratum] + 1
+
+        sample = []
+        distribution = dict()
+        for stratum in sorted(population):
+            reservoir = reservoirs.get(stratum)
+            if allocation[stratum] < len(reservoir):
+                drawn = generator.sample(reservoir, allocation[stratum])
+            else:
+                drawn = reservoir
+            sample.extend(drawn)
+            distribution[stratum] = {"population": population[stratum], "sample": len(drawn)}
 
-        Utility.save_json(output, save_path)
+        generator.shuffle(sample)
+
+        return sample, distribution
 
 
 class Analysis:
     """ A collection of data analysis functions. """
 
+    slice_fields = ["department", "year", "type", "language"]
+    tables = dict()
+
     @classmethod
     def print_chi_square_fit(cls,
                              file_path: str) -> None:
@@ -539,6 +3020,8 @@ class Analysis:
         :param file_path: complete path to file including filename and extension
         """
 
+        import scipy.stats
+
         with open(file_path, mode='r') as file:
             reader = csv.reader(file)
 
@@ -558,65 +3041,243 @@ class Analysis:
         print(scipy.stats.chisquare(f_obs=observed, f_exp=expected))
 
     @classmethod
+    def get_category(cls,
+                     item: Dict,
+                     field: str) -> Union[str, None]:
+        """ Get the category of an item for a chi square test on a field.
+
+        Dates are grouped by decade, for example 2011-2020.
+
+        :param item: the Edoc item
+        :param field: the field
+        """
+
+        if field == "date":
+            values = Selection.get_values(item, "year")
+            if len(values) == 0:
+                return None
+            start = (int(values[0]) - 1) // 10 * 10 + 1
+            return f"{start}-{start + 9}"
+
+        values = Selection.get_values(item, field)
+        if len(values) == 0:
+            return None
+        return values[0]
+
+    @classmethod
+    def count_categories(cls,
+                         path: Union[str, List[str]],
+                         fields: List[str],
+                         presence_fields: List[str] = None) -> Dict[str, Dict[str, int]]:
+        """ Count the items per category of each field in one pass over the input.
+
+        For each presence field, the items with a non-empty presence field are counted per department.
+
+        :param path: complete path to file including filename and extension, complete path to folder of files, or
+            list thereof
+        :param fields: the fields to be counted, for example department, date, type and language
+        :param presence_fields: the presence fields to be counted, defaults to None
+        """
+
+        if presence_fields is None:
+            presence_fields = []
+
+        counts = {field: dict() for field in fields + presence_fields}
+
+        for item in Selection.select(path, Selection.has()):
+            for field in fields:
+                category = cls.get_category(item, field)
+                if category is not None:
+                    counts[field][category] = counts[field].get(category, 0) + 1
+            department = cls.get_category(item, "department")
+            if department is None:
+                continue
+            for field in presence_fields:
+                if item.get(field):
+                    counts[field][department] = counts[field].get(department, 0) + 1
+
+        return counts
+
+    @classmethod
+    @Monitor.timer("make_chi_square")
+    def make_chi_square(cls,
+                        population_path: Union[str, List[str]],
+                        sample_path: Union[str, List[str]] = None,
+                        save_path: str = None,
+                        fields: List[str] = None,
+                        presence_fields: List[str] = None) -> List[Dict]:
+        """ Make chi square goodness of fit tests for many field distributions at once and return the results.
+
+        Each field of the sample is tested against the distribution of the field in the population. Each presence
+        field is tested by comparing the distribution per department of population items with a non-empty presence
+        field against the distribution per department of all population items. The population and the sample are each
+        read in one streaming pass and all tests are computed together.
+
+        The data foundation of each test is saved as /chi_square_{field}.csv with columns category, expected and
+        observed, and the results of all tests are saved as /chi_square.csv in the save folder. Tests without observed
+        items have no result. Sample categories that do not occur in the population cannot be tested; they are
+        reported, listed with expected 0 in the data foundation and counted as missing in the results.
+
+        :param population_path: complete path to file including filename and extension, complete path to folder of
+            files, or list thereof, for example DIR + "/raw"
+        :param sample_path: same for the sample, for example DIR + "/sample/sample_master.json", defaults to None
+        :param save_path: complete path to save folder, defaults to /analysis/chi_square
+        :param fields: the fields to be tested, defaults to department, date, type and language
+        :param presence_fields: the presence fields to be tested, defaults to abstract, id_number and keywords
+        """
+
+        import numpy
+        import scipy.stats
+
+        if save_path is None:
+            save_path = DIR + "/analysis/chi_square"
+        if fields is None:
+            fields = ["department", "date", "type", "language"]
+        if presence_fields is None:
+            presence_fields = ["abstract", "id_number", "keywords"]
+
+        population = cls.count_categories(population_path, list(set(fields + ["department"])), presence_fields)
+
+        tests = []
+        if sample_path is not None:
+            sample = cls.count_categories(sample_path, fields)
+            for field in fields:
+                tests.append((field, population[field], sample[field]))
+        for field in presence_fields:
+            tests.append((field, population["department"], population[field]))
+
+        # pad all distributions to the same number of categories:
+        width = max([len(expected) for name, expected, observed in tests] + [1])
+        expected_table = numpy.full((len(tests), width), numpy.nan)
+        observed_table = numpy.full((len(tests), width), numpy.nan)
+        for row, (name, expected, observed) in enumerate(tests):
+            categories = sorted(expected)
+            expected_table[row, :len(categories)] = [expected[category] for category in categories]
+            observed_table[row, :len(categories)] = [observed.get(category, 0) for category in categories]
+
+        # scale expected frequencies to the observed totals and compute all statistics at once:
+        observed_totals = numpy.nansum(observed_table, axis=1, keepdims=True)
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            expected_table = expected_table / numpy.nansum(expected_table, axis=1, keepdims=True) * observed_totals
+            statistics = numpy.nansum((observed_table - expected_table) ** 2 / expected_table, axis=1)
+        degrees = numpy.sum(~numpy.isnan(expected_table), axis=1) - 1
+        statistics[observed_totals[:, 0] == 0] = numpy.nan
+        p_values = scipy.stats.chi2.sf(statistics, degrees)
+
+        os.makedirs(save_path, exist_ok=True)
+        results = []
+        for row, (name, expected, observed) in enumerate(tests):
+            categories = sorted(expected)
+            missing = {category: count for category, count in observed.items() if category not in expected}
+            if len(missing) > 0:
+                print(f"Warning: {name} categories missing in the population: "
+                      f"{', '.join(f'{category} ({count})' for category, count in sorted(missing.items()))}")
+            with open(save_path + f"/chi_square_{name.split('_')[0]}.csv", mode="w", newline="") as file:
+                writer = csv.writer(file)
+                writer.writerow(["Category", "expected", f"observed {name}"])
+                for column, category in enumerate(categories):
+                    writer.writerow([category, expected_table[row, column], observed_table[row, column]])
+                for category in sorted(missing):
+                    writer.writerow([category, 0.0, float(missing[category])])
+
+            results.append({"field": name,
+                            "chi square": float(statistics[row]),
+                            "df": int(degrees[row]),
+                            "p": float(p_values[row]),
+                            "n": int(observed_totals[row, 0]),
+                            "missing": sum(missing.values())})
+
+        with open(save_path + "/chi_square.csv", mode="w", newline="") as file:
+            writer = csv.DictWriter(file, fieldnames=["field", "chi square", "df", "p", "n", "missing"])
+            writer.writeheader()
+            writer.writerows(results)
+
+        for result in results:
+            print(f"{result['field']}: chi square (df={result['df']}) = {result['chi square']}, p = {result['p']}, "
+                  f"{result['missing']} untested")
+
+        return results
+
+    @classmethod
+    @Monitor.timer("make_random_sample")
     def make_random_sample(cls,
-                           file_path: str,
+                           file_path: Union[str, List[str]],
                            save_path: str,
-                           size: int) -> None:
+                           size: int = None,
+                           seed: int = None,
+                           stratify: str = None,
+                           quotas: Dict[str, int] = None) -> None:
         """ Save a random sample from the population in the file.
 
-        :param file_path: complete path to file including filename and extension
+        The population is streamed, so it is never loaded into memory as a whole. If the sample is stratified, the
+        distribution of population and sample per stratum is saved as {save_path}_distribution.json.
+
+        For example: make_random_sample(DIR + "/raw", DIR + "/sample/sample_random.json", 500, seed=1,
+        stratify="department")
+
+        :param file_path: complete path to file including filename and extension, complete path to folder of files, or
+            list thereof
         :param save_path: complete path to save folder including filename and extension
-        :param size: the sample size
+        :param size: the sample size, required unless quotas are given, defaults to None
+        :param seed: seed for a reproducible sample, defaults to None
+        :param stratify: field to stratify by such as department, year or type, defaults to None
+        :param quotas: sample size per stratum value if stratified, instead of size, defaults to None
         """
 
-        population = Utility.load_json(file_path)
-        import random
+        if quotas is not None and stratify is None:
+            raise ValueError("Quotas require a field to stratify by")
+        if (size is None) == (quotas is None):
+            raise ValueError("Give either a sample size or quotas per stratum")
+
+        population = Selection.select(file_path, Selection.has())
+
+        if stratify is None:
+            sample = Sampling.reservoir(population, size=size, seed=seed)
+        else:
+            sample, distribution = Sampling.stratified(population, stratify, size=size, quotas=quotas, seed=seed)
+            for stratum, counts in distribution.items():
+                print(f"{stratum}: {counts['sample']} of {counts['population']}")
+            Utility.save_json(distribution, os.path.splitext(save_path)[0] + "_distribution.json")
 
-        sample = random.sample(population=population, k=size)
+        Monitor.count("make_random_sample", len(sample))
         Utility.save_json(sample, save_path)
 
     @classmethod
     def super_make_metrics(cls,
                            file_path: str,
-                           department: str = None):
+                           department: Union[str, List[str]] = None,
+                           stats: bool = True,
+                           save_path: str = None,
+                           table_path: str = None):
         """ Make metrics for all combinations of Annif projects and parameters in enriched Edoc file.
 
-        Output files are saved in /metrics/. Joint results are saved in /analysis/metrics.json.
+        The file is scanned once into the confusion table, from which the metrics of all items and of each department
+        are summed. Output files are saved in /metrics/. Joint results are saved as in super_make_stats.
 
         :param file_path: complete path to file including filename and extension
-        :param department: restrict to items from department
+        :param department: restrict to items from department or from each of several departments
+        :param stats: toggle make joint results, defaults to True
+        :param save_path: complete path to folder for the metrics files, defaults to /metrics
+        :param table_path: complete path to save the confusion table including filename and extension, defaults to
+            /analysis/confusion.npz
         """
 
-        project_ids = ["yso-en", "yso-maui-en", "yso-bonsai-en", "yso-fasttext-en", "wikidata-en"]
+        with Monitor.run("super_make_metrics"):
+            table = cls.make_confusion_table(file_path, save_path=table_path)
+
+            if department is None:
+                cls.make_slice_metrics(table=table, save_path=save_path)
+            elif isinstance(department, str):
+                cls.make_slice_metrics({"department": department}, table=table, save_path=save_path)
+            else:
+                for entry in department:
+                    cls.make_slice_metrics({"department": entry}, table=table, save_path=save_path)
 
-        n = 1
-        while n < 11:
-            for project_id in project_ids:
-                # title:
-                cls.make_metrics(file_path=file_path,
-                                 project_id=project_id,
-                                 department=department)
-                # title + abstract:
-                cls.make_metrics(file_path=file_path,
-                                 project_id=project_id,
-                                 abstract=True,
-                                 department=department)
-                # title + limit:
-                cls.make_metrics(file_path=file_path,
-                                 project_id=project_id,
-                                 n=n,
-                                 department=department)
-                # title + limit:
-                cls.make_metrics(file_path=file_path,
-                                 project_id=project_id,
-                                 abstract=True,
-                                 n=n,
-                                 department=department)
-            n = n + 1
-
-        cls.super_make_stats()
+            if stats is True:
+                cls.super_make_stats(file_path=save_path)
 
     @classmethod
+    @Monitor.timer("make_metrics")
     def make_metrics(cls,
                      file_path: str,
                      project_id: str,
@@ -643,6 +3304,8 @@ class Analysis:
         :param department: restrict to items from department
         """
 
+        from sklearn.metrics import f1_score, recall_score, precision_score
+
         data = Utility.load_json(file_path)
 
         # construct the correct annif marker:
@@ -657,6 +3320,7 @@ class Analysis:
             if department is not None:
                 if item.get("department") != department:
                     continue
+            Monitor.count("make_metrics")
             sklearn_array = cls.get_sklearn_array(item=item,
                                                   project_id=project_id,
                                                   abstract=abstract,
@@ -733,6 +3397,339 @@ class Analysis:
             "FN": false_negative
         }
 
+    @classmethod
+    def get_markers(cls) -> List[Dict]:
+        """ Get the markers evaluated by super_make_metrics with their parameters.
+
+        Each marker is project_id-abstract-fulltext-n-threshold as in the file names in /metrics/.
+        """
+
+        project_ids = ["yso-en", "yso-maui-en", "yso-bonsai-en", "yso-fasttext-en", "wikidata-en"]
+
+        return [{"marker": f"{project_id}-{abstract}-False-{n}-None", "project_id": project_id, "abstract": abstract,
+                 "n": n} for project_id in project_ids for abstract in [False, True] for n in range(1, 11)]
+
+    @classmethod
+    def get_confusion(cls,
+                      item: dict,
+                      project_id: str,
+                      abstract: bool = False,
+                      n: int = 10) -> Union[List[int], None]:
+        """ Get the confusion counts that the item adds to the Sklearn y_true and y_pred of make_metrics.
+
+        The counts are [true 1 and predicted 1, true 1 and predicted 0, true 0 and predicted 1, true 0 and predicted 0]
+        and are None if make_metrics skips the item.
+
+        :param item: the Edoc item
+        :param project_id: Annif-client project ID
+        :param abstract: toggle use abstract for indexing, defaults to False
+        :param n: number of top IDs (by score) to be extracted, defaults to 10
+        """
+
+        if item.get("annif", dict()).get(f"{project_id}-{abstract}-False-None-None") is None:
+            return None
+
+        sklearn_array = cls.get_sklearn_array(item=item, project_id=project_id, abstract=abstract, n=n)
+        if sklearn_array is None:
+            return None
+
+        counts = [0, 0, 0, 0]
+        for true, predicted in zip(sklearn_array.get("y_true"), sklearn_array.get("y_pred")):
+            counts[(1 - true) * 2 + (1 - predicted)] += 1
+
+        return counts
+
+    @classmethod
+    def count_item(cls,
+                   item: dict) -> Dict[str, List[int]]:
+        """ Get the confusion counts of the item for all markers of get_markers.
+
+        :param item: the Edoc item
+        """
+
+        counts = dict()
+        for marker in cls.get_markers():
+            confusion = cls.get_confusion(item, marker["project_id"], abstract=marker["abstract"], n=marker["n"])
+            if confusion is not None:
+                counts[marker["marker"]] = confusion
+
+        return counts
+
+    @classmethod
+    def compute_metrics(cls,
+                        counts: List[int]) -> Dict:
+        """ Compute the metrics of make_metrics from confusion counts without Sklearn.
+
+        The results equal the Sklearn F1, recall and precision scores on the underlying y_true and y_pred.
+
+        :param counts: [true 1 and predicted 1, true 1 and predicted 0, true 0 and predicted 1, true 0 and predicted 0]
+        """
+
+        true_1_predicted_1, true_1_predicted_0, true_0_predicted_1, true_0_predicted_0 = counts
+        size = sum(counts)
+
+        def divide(numerator, denominator):
+            return numerator / denominator if denominator > 0 else 0.0
+
+        # per label: true positives, false positives, false negatives, and whether the label occurs at all:
+        labels = [(true_0_predicted_0, true_1_predicted_0, true_0_predicted_1,
+                   true_1_predicted_0 + true_0_predicted_1 + true_0_predicted_0 > 0),
+                  (true_1_predicted_1, true_0_predicted_1, true_1_predicted_0,
+                   true_1_predicted_1 + true_1_predicted_0 + true_0_predicted_1 > 0)]
+
+        scores = []
+        for true_positive, false_positive, false_negative, present in labels:
+            if present is True:
+                scores.append({"F1": divide(2 * true_positive, 2 * true_positive + false_positive + false_negative),
+                               "Precision": divide(true_positive, true_positive + false_positive),
+                               "Recall": divide(true_positive, true_positive + false_negative),
+                               "support": true_positive + false_negative})
+
+        metrics = dict()
+        for score in ["F1", "Precision", "Recall"]:
+            metrics[f"{score}-binary"] = scores[-1][score] if labels[1][3] is True else 0.0
+        for score in ["F1", "Precision", "Recall"]:
+            metrics[f"{score}-macro"] = divide(sum(label[score] for label in scores), len(scores))
+        for score in ["F1", "Precision", "Recall"]:
+            metrics[f"{score}-micro"] = divide(true_1_predicted_1 + true_0_predicted_0, size)
+        support = sum(label["support"] for label in scores)
+        for score in ["F1", "Precision", "Recall"]:
+            metrics[f"{score}-weighted"] = divide(sum(label[score] * label["support"] for label in scores), support)
+
+        metrics["Sample size"] = size
+        metrics.update({"TP": true_1_predicted_1 + true_0_predicted_0,
+                        "TN": 0,
+                        "FP": true_0_predicted_1,
+                        "FN": true_1_predicted_0})
+
+        return metrics
+
+    @classmethod
+    def build_confusion_table(cls,
+                              data: List[Dict]) -> Dict[str, numpy.ndarray]:
+        """ Build the table of confusion counts per item and marker of enriched Edoc items.
+
+        The table holds the counts of get_confusion as array of shape (items, markers, 4) and the slice fields
+        department, year, type and language as one column each; row i belongs to item i. Items that make_metrics skips
+        for a marker count zero.
+
+        :param data: the enriched Edoc items
+        """
+
+        import numpy
+
+        markers = cls.get_markers()
+
+        counts = numpy.zeros((len(data), len(markers), 4), dtype=numpy.int32)
+        for position, item in enumerate(data):
+            item_counts = cls.count_item(item)
+            for column, marker in enumerate(markers):
+                if marker["marker"] in item_counts:
+                    counts[position, column] = item_counts[marker["marker"]]
+        Monitor.count("make_confusion_table", len(data))
+
+        table = {"markers": numpy.array([marker["marker"] for marker in markers]), "counts": counts}
+        table.update(cls.get_slice_columns(data))
+
+        return table
+
+    @classmethod
+    def get_slice_columns(cls,
+                          data: List[Dict]) -> Dict[str, numpy.ndarray]:
+        """ Get the slice fields of the confusion table as one column each.
+
+        :param data: the Edoc items
+        """
+
+        import numpy
+
+        columns = dict()
+        for field in cls.slice_fields:
+            values = [Selection.get_values(item, field) for item in data]
+            columns[field] = numpy.array([entry[0] if len(entry) > 0 else "" for entry in values], dtype=str)
+
+        return columns
+
+    @classmethod
+    def save_confusion_table(cls,
+                             table: Dict[str, numpy.ndarray],
+                             save_path: str = None) -> None:
+        """ Save the table of confusion counts.
+
+        :param table: the table of confusion counts
+        :param save_path: complete path to save folder including filename and extension, defaults to
+        /analysis/confusion.npz
+        """
+
+        import numpy
+
+        if save_path is None:
+            save_path = DIR + "/analysis/confusion.npz"
+
+        numpy.savez_compressed(save_path, **table)
+        cls.tables[save_path] = (os.path.getmtime(save_path), table)
+
+    @classmethod
+    def get_fingerprint(cls,
+                        file_path: str) -> numpy.ndarray:
+        """ Get the fingerprint of an enriched Edoc file, which is the SHA-1 hash of its content.
+
+        The fingerprint is stored in the confusion table to recognize a table made from a different file.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        import numpy
+
+        fingerprint = hashlib.sha1()
+        with open(file_path, "rb") as file:
+            for chunk in iter(partial(file.read, 2 ** 20), b""):
+                fingerprint.update(chunk)
+
+        return numpy.array(fingerprint.hexdigest())
+
+    @classmethod
+    def get_table_path(cls,
+                       file_path: str) -> str:
+        """ Get the path of the confusion table of an enriched Edoc file, which is confusion.npz in the same folder.
+
+        :param file_path: complete path to file including filename and extension
+        """
+
+        return os.path.join(os.path.dirname(os.path.abspath(file_path)), "confusion.npz")
+
+    @classmethod
+    @Monitor.timer("make_confusion_table")
+    def make_confusion_table(cls,
+                             file_path: str,
+                             save_path: str = None) -> Dict[str, numpy.ndarray]:
+        """ Make the table of confusion counts per item and marker of enriched Edoc file.
+
+        The table is built as in build_confusion_table and holds the fingerprint of the file of get_fingerprint. The
+        output is saved as /analysis/confusion.npz.
+
+        :param file_path: complete path to file including filename and extension
+        :param save_path: complete path to save folder including filename and extension, defaults to
+        /analysis/confusion.npz
+        """
+
+        table = cls.build_confusion_table(Utility.load_json(file_path))
+        table["fingerprint"] = cls.get_fingerprint(file_path)
+        cls.save_confusion_table(table, save_path)
+
+        return table
+
+    @classmethod
+    def load_confusion_table(cls,
+                             file_path: str = None) -> Dict[str, numpy.ndarray]:
+        """ Load the table of confusion counts made by make_confusion_table.
+
+        The file is loaded once and loaded again only if it changes.
+
+        :param file_path: complete path to file including filename and extension, defaults to /analysis/confusion.npz
+        """
+
+        import numpy
+
+        if file_path is None:
+            file_path = DIR + "/analysis/confusion.npz"
+
+        modified = os.path.getmtime(file_path)
+        cached = cls.tables.get(file_path)
+        Monitor.cache("confusion table", cached is not None and cached[0] == modified)
+
+        if cached is None or cached[0] != modified:
+            with numpy.load(file_path) as archive:
+                cls.tables[file_path] = (modified, {name: archive[name] for name in archive.files})
+
+        return cls.tables[file_path][1]
+
+    @classmethod
+    def get_slice_counts(cls,
+                         table: Dict[str, numpy.ndarray],
+                         selection: Dict[str, Union[str, List[str]]] = None) -> Dict[str, List[int]]:
+        """ Sum the confusion counts per marker over the items in a slice.
+
+        For example: get_slice_counts(table, {"department": "Faculty_of_Science", "year": ["2019", "2020"]})
+
+        :param table: the table of confusion counts
+        :param selection: accepted values per slice field, defaults to all items
+        """
+
+        import numpy
+
+        mask = numpy.ones(len(table["counts"]), dtype=bool)
+        for field, values in (selection or dict()).items():
+            if isinstance(values, str):
+                values = [values]
+            mask = mask & numpy.isin(table[field], [str(value) for value in values])
+
+        sums = table["counts"][mask].sum(axis=0)
+
+        return {str(marker): [int(count) for count in counts] for marker, counts in zip(table["markers"], sums)}
+
+    @classmethod
+    def make_slice_metrics(cls,
+                           selection: Dict[str, Union[str, List[str]]] = None,
+                           table: Dict[str, numpy.ndarray] = None,
+                           save: bool = True,
+                           save_path: str = None) -> Dict[str, Dict]:
+        """ Make the metrics of make_metrics for all markers for a slice of the confusion table.
+
+        The output is saved as /metrics/metrics_{marker}.json for all items and as
+        /metrics/metrics_{values}_{marker}.json for a slice, for example /metrics/metrics_{department}_{marker}.json.
+
+        :param selection: accepted values per slice field, defaults to all items
+        :param table: the table of confusion counts, defaults to /analysis/confusion.npz
+        :param save: toggle save the metrics, defaults to True
+        :param save_path: complete path to folder for the metrics files, defaults to /metrics
+        """
+
+        if table is None:
+            table = cls.load_confusion_table()
+        if save_path is None:
+            save_path = DIR + "/metrics"
+
+        prefix = None
+        if selection:
+            prefix = "_".join(values if isinstance(values, str) else "-".join(str(value) for value in values)
+                              for values in selection.values())
+
+        print(f"Working on {prefix}...", end="")
+
+        results = dict()
+        for marker, counts in cls.get_slice_counts(table, selection).items():
+            results[marker] = cls.compute_metrics(counts)
+            if save is False:
+                continue
+            if prefix is None:
+                Utility.save_json(results[marker], save_path + f"/metrics_{marker}.json")
+            else:
+                Utility.save_json(results[marker], save_path + f"/metrics_{prefix}_{marker}.json")
+
+        print("done.")
+
+        return results
+
+    @classmethod
+    def make_department_metrics(cls,
+                                table: Dict[str, numpy.ndarray] = None,
+                                save_path: str = None) -> None:
+        """ Make the metrics files for all items and for each department from the confusion table.
+
+        The output is saved as in make_slice_metrics.
+
+        :param table: the table of confusion counts, defaults to /analysis/confusion.npz
+        :param save_path: complete path to folder for the metrics files, defaults to /metrics
+        """
+
+        if table is None:
+            table = cls.load_confusion_table()
+
+        cls.make_slice_metrics(table=table, save_path=save_path)
+        for department in sorted(set(str(value) for value in table["department"]) - {""}):
+            cls.make_slice_metrics({"department": department}, table=table, save_path=save_path)
+
     @classmethod
     def get_sklearn_array(cls,
                           item: dict,
@@ -862,20 +3859,454 @@ class Analysis:
             return gold_standard_ids
 
     @classmethod
-    def super_make_stats(cls) -> None:
+    @Monitor.timer("super_make_stats")
+    def super_make_stats(cls,
+                         file_path: str = None,
+                         save_path: str = None) -> None:
         """ Make metrics for files in /metrics.
 
         Output is saved as /analysis/metrics.json.
+
+        :param file_path: complete path to folder with metrics files, defaults to /metrics
+        :param save_path: complete path to save folder including filename and extension, defaults to
+            /analysis/metrics.json for /metrics and to the folder path with extension .json otherwise
         """
 
+        if save_path is None:
+            save_path = DIR + "/analysis/metrics.json" if file_path is None else file_path + ".json"
+        if file_path is None:
+            file_path = DIR + "/metrics"
+
         stats = []
 
-        files = os.listdir(DIR + "/metrics")
+        files = os.listdir(file_path)
         for file in files:
 
-            metrics = Utility.load_json(DIR + f"/metrics/{file}")
+            metrics = Utility.load_json(file_path + f"/{file}")
             metrics["file"] = file.split("/")[len(file.split("/"))-1]
 
             stats.append({"stat": metrics})
 
-        Utility.save_json(stats, DIR + "/analysis/metrics.json")
+        Utility.save_json(stats, save_path)
+
+
+class Incremental:
+    """ Update an enriched Edoc file with a new Edoc file by enriching only new and changed items.
+
+    Items are matched by key field and compared by a content hash of title, abstract and keywords. The metrics in
+    the folder metrics next to the enriched file are updated from its confusion table instead of being recomputed.
+    """
+
+    hash_fields = ["title", "abstract", "keywords"]
+
+    @classmethod
+    def get_hash(cls,
+                 item: dict) -> str:
+        """ Get the content hash of an item.
+
+        :param item: the Edoc item
+        """
+
+        content = dumps([item.get(field) for field in cls.hash_fields], sort_keys=True, ensure_ascii=False)
+
+        return hashlib.sha1(content.encode("utf-8")).hexdigest()
+
+    @classmethod
+    def get_key(cls,
+                item: dict,
+                key_field: str = "eprintid") -> str:
+        """ Get the key of an item, which is its key field or else its content hash.
+
+        :param item: the Edoc item
+        :param key_field: the field that identifies an item, defaults to eprintid
+        """
+
+        key = item.get(key_field)
+        if key is None:
+            return cls.get_hash(item)
+
+        return str(key)
+
+    @classmethod
+    def split(cls,
+              new_data: List[Dict],
+              enriched_data: List[Dict],
+              key_field: str = "eprintid") -> Tuple[List[Dict], Dict[int, int], List[Dict]]:
+        """ Split new data into changed items and unchanged items with respect to enriched data.
+
+        Returns the changed (including new) items, the position in enriched data of each unchanged item by its position
+        in new data, and the enriched items that are not reused. Each enriched item is matched at most once, so items
+        sharing a key, such as duplicates keyed by content hash, are matched pairwise.
+
+        :param new_data: the new Edoc items
+        :param enriched_data: the enriched Edoc items
+        :param key_field: the field that identifies an item, defaults to eprintid
+        """
+
+        candidates = dict()
+        for position, item in enumerate(enriched_data):
+            candidates.setdefault(cls.get_key(item, key_field), []).append(position)
+
+        changed = []
+        unchanged = dict()
+        for new_position, item in enumerate(new_data):
+            content_hash = cls.get_hash(item)
+            positions = candidates.get(cls.get_key(item, key_field), [])
+            for position in positions:
+                old_item = enriched_data[position]
+                if old_item.get("content hash", cls.get_hash(old_item)) == content_hash:
+                    unchanged[new_position] = position
+                    positions.remove(position)
+                    break
+            else:
+                changed.append(item)
+
+        reused = set(unchanged.values())
+        stale = [item for position, item in enumerate(enriched_data) if position not in reused]
+
+        return changed, unchanged, stale
+
+    @classmethod
+    def enrich(cls,
+               file_path: str,
+               work_path: str,
+               client: LocalAnnif = None) -> List[Dict]:
+        """ Enrich Edoc file with the clean, reference, MeSH and Annif stages of the pipeline and return the items.
+
+        The yso stage is only run if the YSO-enriched reference keywords in the work folder are missing or stale.
+
+        :param file_path: complete path to file including filename and extension
+        :param work_path: complete path to folder for intermediate files
+        :param client: Annif client with the interface of AnnifClient such as LocalAnnif, defaults to None
+        """
+
+        stages = Pipeline.get_stages(work_path=work_path, client=client)
+
+        if os.path.abspath(file_path) != os.path.abspath(work_path + "/sample.json"):
+            Utility.save_json(Utility.load_json(file_path), work_path + "/sample.json")
+
+        Pipeline.run([stage for stage in stages if stage.get("name") == "yso"])
+        Pipeline.run([stage for stage in stages
+                      if stage.get("name") in ["clean", "reference", "mesh", "annif", "annif_abstract", "merge"]],
+                     force=True)
+
+        return Utility.load_json(work_path + "/indexed.json")
+
+    @classmethod
+    @Monitor.timer("update")
+    def update(cls,
+               new_path: str,
+               enriched_path: str = None,
+               save_path: str = None,
+               client: LocalAnnif = None,
+               key_field: str = "eprintid",
+               work_path: str = None,
+               metrics: bool = True) -> None:
+        """ Update enriched Edoc file with new Edoc file and update the metrics.
+
+        Unchanged items keep their enrichment, new and changed items are enriched, removed items are dropped. In the
+        confusion table of the enriched file (see Analysis.get_table_path), the rows of the stale items are dropped and
+        the rows of the enriched items are appended; the metrics of all items and of each department are then made
+        from the table and saved in the folder metrics next to the saved file, with joint results in metrics.json. A
+        table whose fingerprint does not match the enriched file is rebuilt first.
+
+        :param new_path: complete path to new Edoc file including filename and extension
+        :param enriched_path: complete path to last enriched Edoc file, defaults to /pipeline/indexed.json
+        :param save_path: complete path to save folder including filename and extension, defaults to enriched_path
+        :param client: Annif client with the interface of AnnifClient such as LocalAnnif, defaults to None
+        :param key_field: the field that identifies an item, defaults to eprintid
+        :param work_path: complete path to folder for intermediate files, defaults to /pipeline/incremental
+        :param metrics: toggle update metrics, defaults to True
+        """
+
+        import numpy
+
+        if enriched_path is None:
+            enriched_path = DIR + "/pipeline/indexed.json"
+        if save_path is None:
+            save_path = enriched_path
+        if work_path is None:
+            work_path = DIR + "/pipeline/incremental"
+
+        new_data = Utility.load_json(new_path)
+        enriched_data = []
+        if os.path.exists(enriched_path):
+            enriched_data = Utility.load_json(enriched_path)
+
+        # make the confusion table of the last enriched file unless it exists and matches; its rows follow the file:
+        table = None
+        if metrics is True:
+            table_path = Analysis.get_table_path(enriched_path)
+            if os.path.exists(table_path) and os.path.exists(enriched_path):
+                table = Analysis.load_confusion_table(table_path)
+                markers = [marker["marker"] for marker in Analysis.get_markers()]
+                if str(table.get("fingerprint")) != str(Analysis.get_fingerprint(enriched_path)) or \
+                        list(table["markers"]) != markers:
+                    print(f"Warning: {table_path} does not match {enriched_path} and is rebuilt")
+                    table = None
+            if table is None:
+                table = Analysis.build_confusion_table(enriched_data)
+
+        changed, unchanged, stale = cls.split(new_data, enriched_data, key_field)
+        print(f"{len(changed)} new or changed, {len(unchanged)} unchanged, {len(stale)} stale items")
+        Monitor.count("update changed", len(changed))
+        Monitor.count("update unchanged", len(unchanged))
+
+        enriched_changed = []
+        if len(changed) > 0:
+            os.makedirs(work_path, exist_ok=True)
+            Utility.save_json(changed, work_path + "/sample.json")
+            enriched_changed = cls.enrich(work_path + "/sample.json", work_path, client)
+            assert(len(enriched_changed) == len(changed))
+
+        # keep the order of the new file; rows holds the table row of each updated item, where the rows of the enriched
+        # items follow the rows of the last enriched file:
+        updated = []
+        rows = []
+        appended = []
+        enriched_changed = iter(enriched_changed)
+        for position, item in enumerate(new_data):
+            if position in unchanged:
+                updated_item = dict(enriched_data[unchanged.get(position)], **item)
+                rows.append(unchanged.get(position))
+            else:
+                updated_item = next(enriched_changed)
+                rows.append(len(enriched_data) + len(appended))
+                appended.append(updated_item)
+            updated_item["content hash"] = cls.get_hash(item)
+            updated.append(updated_item)
+
+        Utility.save_json(updated, save_path)
+
+        # save the updated confusion table next to the saved file with the fingerprint of that file:
+        if table is not None:
+            counts = numpy.concatenate([table["counts"], Analysis.build_confusion_table(appended)["counts"]])
+            table = {"markers": table["markers"], "counts": counts[numpy.array(rows, dtype=int)],
+                     "fingerprint": Analysis.get_fingerprint(save_path)}
+            table.update(Analysis.get_slice_columns(updated))
+            Analysis.save_confusion_table(table, Analysis.get_table_path(save_path))
+            # save the metrics next to the saved file as the pipeline does, not over the results in /metrics/:
+            metrics_path = os.path.join(os.path.dirname(os.path.abspath(save_path)), "metrics")
+            os.makedirs(metrics_path, exist_ok=True)
+            Analysis.make_department_metrics(table, save_path=metrics_path)
+            Analysis.super_make_stats(metrics_path, metrics_path + ".json")
+
+
+class Pipeline:
+    """ A collection of functions for running the Edoc workflow as a pipeline.
+
+    A pipeline is a list of stages. Each stage is a dictionary with a name, input files, output files and an action
+    without arguments. A stage depends on the stages that produce its input files.
+    """
+
+    @classmethod
+    def get_stages(cls,
+                   raw_path: str = None,
+                   work_path: str = None,
+                   client: LocalAnnif = None) -> List[Dict]:
+        """ Get the stages of the Edoc workflow: select, clean, enrich (YSO, reference, MeSH, Annif), evaluate, stats.
+
+        All outputs are written to the work folder. The reference keywords in /keywords/keywords_reference.json are an
+        input only; the yso stage saves them enriched with YSO IDs in the work folder for the reference stage.
+
+        :param raw_path: complete path to folder with raw Edoc files, defaults to /raw
+        :param work_path: complete path to folder for intermediate files, defaults to /pipeline
+        :param client: Annif client with the interface of AnnifClient such as LocalAnnif, defaults to None
+        """
+
+        if raw_path is None:
+            raw_path = DIR + "/raw"
+        if work_path is None:
+            work_path = DIR + "/pipeline"
+
+        raw_paths = []
+        if os.path.isdir(raw_path):
+            raw_paths = [f"{raw_path}/{file}" for file in sorted(os.listdir(raw_path)) if file.endswith(".json")]
+
+        markers = [marker["marker"] for marker in Analysis.get_markers()]
+
+        sample = work_path + "/sample.json"
+        clean = work_path + "/clean.json"
+        reference = work_path + "/keywords_reference.json"
+        indexed = work_path + "/indexed.json"
+        metrics = [work_path + f"/metrics/metrics_{marker}.json" for marker in markers]
+
+        return [{"name": "select",
+                 "inputs": raw_paths,
+                 "outputs": [sample],
+                 "action": partial(Data.select_from_files, raw_paths, sample,
+                                   "title", "abstract", "keywords", "id_number")},
+                {"name": "clean",
+                 "inputs": [sample],
+                 "outputs": [clean],
+                 "action": partial(Data.clean_author_keywords, sample, clean)},
+                {"name": "yso",
+                 "inputs": [DIR + "/keywords/keywords_reference.json"],
+                 "outputs": [reference],
+                 "action": partial(Keywords.enrich_with_yso, DIR + "/keywords/keywords_reference.json", reference)},
+                {"name": "reference",
+                 "inputs": [clean, reference],
+                 "outputs": [work_path + "/reference.json"],
+                 "action": partial(Data.enrich_author_keywords, clean, work_path + "/reference", reference)},
+                {"name": "mesh",
+                 "inputs": [sample],
+                 "outputs": [work_path + "/mesh.json"],
+                 "action": partial(Data.enrich_with_mesh, sample, work_path + "/mesh")},
+                {"name": "annif",
+                 "inputs": [sample],
+                 "outputs": [work_path + "/annif.json"],
+                 "action": partial(Data.super_enrich_with_annif, False, sample, work_path + "/annif.json", client)},
+                {"name": "annif_abstract",
+                 "inputs": [sample],
+                 "outputs": [work_path + "/annif_abstract.json"],
+                 "action": partial(Data.super_enrich_with_annif, True, sample, work_path + "/annif_abstract.json",
+                                   client)},
+                {"name": "merge",
+                 "inputs": [work_path + "/reference.json", work_path + "/mesh.json",
+                            work_path + "/annif.json", work_path + "/annif_abstract.json"],
+                 "outputs": [indexed],
+                 "action": partial(Data.merge_enriched,
+                                   [work_path + "/reference.json", work_path + "/mesh.json",
+                                    work_path + "/annif.json", work_path + "/annif_abstract.json"], indexed)},
+                {"name": "evaluate",
+                 "inputs": [indexed],
+                 "outputs": metrics + [Analysis.get_table_path(indexed)],
+                 "action": partial(Analysis.super_make_metrics, indexed, None, False, work_path + "/metrics",
+                                   Analysis.get_table_path(indexed))},
+                {"name": "stats",
+                 "inputs": metrics,
+                 "outputs": [work_path + "/metrics.json"],
+                 "action": partial(Analysis.super_make_stats, work_path + "/metrics", work_path + "/metrics.json")}]
+
+    @classmethod
+    def get_dependencies(cls,
+                         stages: List[Dict]) -> Dict[str, List[str]]:
+        """ Get the names of the stages each stage depends on.
+
+        :param stages: the stages
+        """
+
+        producers = dict()
+        for stage in stages:
+            for output in stage.get("outputs"):
+                producers[output] = stage.get("name")
+
+        dependencies = dict()
+        for stage in stages:
+            dependencies[stage.get("name")] = sorted({producers[file] for file in stage.get("inputs")
+                                                      if file in producers and producers[file] != stage.get("name")})
+
+        return dependencies
+
+    @classmethod
+    def is_up_to_date(cls,
+                      stage: Dict) -> bool:
+        """ Check if all inputs and outputs of a stage exist and the outputs are newer than the inputs.
+
+        :param stage: the stage
+        """
+
+        for file in stage.get("outputs") + stage.get("inputs"):
+            if not os.path.exists(file):
+                return False
+
+        if len(stage.get("inputs")) == 0:
+            return True
+
+        oldest_output = min(os.path.getmtime(output) for output in stage.get("outputs"))
+        newest_input = max(os.path.getmtime(file) for file in stage.get("inputs"))
+
+        return oldest_output >= newest_input
+
+    @classmethod
+    def run_stage(cls,
+                  stage: Dict) -> None:
+        """ Run a stage.
+
+        :param stage: the stage
+        """
+
+        for output in stage.get("outputs"):
+            os.makedirs(os.path.dirname(output), exist_ok=True)
+
+        print(f"Running stage {stage.get('name')}...")
+        with Monitor.timer(f"stage {stage.get('name')}"):
+            stage.get("action")()
+        print(f"Stage {stage.get('name')} done.")
+
+    @classmethod
+    def run(cls,
+            stages: List[Dict],
+            targets: List[str] = None,
+            workers: int = 4,
+            force: bool = False,
+            dry_run: bool = False) -> List[str]:
+        """ Run the stages in dependency order and return the names of the stages that were run.
+
+        Stages whose dependencies are done run in parallel, so fetch-heavy and CPU-heavy stages overlap. Stages whose
+        outputs are newer than their inputs are skipped.
+
+        :param stages: the stages
+        :param targets: names of the stages to be run including the stages they depend on, defaults to all stages
+        :param workers: maximum number of stages running at the same time, defaults to 4
+        :param force: toggle run stages even if they are up to date, defaults to False
+        :param dry_run: toggle only print which stages would be run, defaults to False
+        """
+
+        dependencies = cls.get_dependencies(stages)
+        by_name = {stage.get("name"): stage for stage in stages}
+
+        # restrict to targets and the stages they depend on:
+        if targets is None:
+            targets = list(by_name)
+        required = set()
+        todo = list(targets)
+        while len(todo) > 0:
+            name = todo.pop()
+            if name not in by_name:
+                raise ValueError(f"Unknown stage {name}")
+            if name not in required:
+                required.add(name)
+                todo = todo + dependencies.get(name)
+
+        pending = [stage for stage in stages if stage.get("name") in required]
+        done = set()
+        ran = []
+        running = dict()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while len(pending) > 0 or len(running) > 0:
+
+                # start all stages whose dependencies are done:
+                ready = [stage for stage in pending
+                         if all(name in done for name in dependencies.get(stage.get("name")))]
+                for stage in ready:
+                    pending.remove(stage)
+                    name = stage.get("name")
+                    upstream_ran = any(dependency in ran for dependency in dependencies.get(name))
+                    if force is False and upstream_ran is False and cls.is_up_to_date(stage):
+                        print(f"Stage {name} is up to date, skipping.")
+                        done.add(name)
+                    elif dry_run is True:
+                        print(f"Stage {name} would be run.")
+                        ran.append(name)
+                        done.add(name)
+                    else:
+                        missing = [file for file in stage.get("inputs") if not os.path.exists(file)]
+                        if len(missing) > 0:
+                            raise FileNotFoundError(f"Stage {name} is missing inputs {missing}")
+                        running[executor.submit(cls.run_stage, stage)] = name
+
+                if len(ready) > 0 and len(running) == 0:
+                    continue
+                if len(running) == 0:
+                    raise RuntimeError(f"Stages {[stage.get('name') for stage in pending]} cannot be scheduled")
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    future.result()
+                    ran.append(name)
+                    done.add(name)
+
+        return ran
@@ -0,0 +1,211 @@
+""" Command-line runner for the Edoc workflow.
+
+For example: python -m files run --workers 4 evaluate
+"""
+
+import argparse
+import os.path
+from files import Pipeline, Monitor, Selection, Analysis, LocalAnnif, Http, Incremental, Utility, Refine, DIR
+
+
+def main() -> None:
+    """ Parse the command line and run the requested command. """
+
+    parser = argparse.ArgumentParser(prog="python -m files", description="Run the Edoc workflow.")
+    parser.add_argument("--raw", default=None, help="folder with raw Edoc files, defaults to /raw")
+    parser.add_argument("--work", default=None, help="folder for intermediate files, defaults to /pipeline")
+    parser.add_argument("--annif-api", default=None, help="base URL of the Annif REST API, for example a local server")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("list", help="list the stages, their dependencies and whether they are up to date")
+
+    run = commands.add_parser("run", help="run the stages and the stages they depend on")
+    run.add_argument("stages", nargs="*", help="names of the stages to be run, defaults to all stages")
+    run.add_argument("--workers", type=int, default=4, help="maximum number of stages running at the same time")
+    run.add_argument("--force", action="store_true", help="run stages even if they are up to date")
+    run.add_argument("--dry-run", action="store_true", help="only print which stages would be run")
+    run.add_argument("--profile", action="store_true", help="profile the run with cProfile")
+    run.add_argument("--report", default=None, help="path of the run report, defaults to /reports/")
+    run.add_argument("--trace-memory", action="store_true",
+                     help="trace the memory peak of the run with tracemalloc, which slows the run down")
+
+    index = commands.add_parser("index", help="build secondary indexes for raw or sharded Edoc files")
+    index.add_argument("path", help="file or folder of files")
+    index.add_argument("--fields", nargs="+", default=None, help="fields to be indexed")
+
+    select = commands.add_parser("select", help="select items from raw or sharded Edoc files")
+    select.add_argument("path", help="file or folder of files")
+    select.add_argument("save_path", help="path of the output file")
+    select.add_argument("--has", nargs="+", default=[], help="required fields")
+    select.add_argument("--department", nargs="+", default=None, help="accepted departments")
+    select.add_argument("--type", nargs="+", default=None, help="accepted types")
+    select.add_argument("--language", nargs="+", default=None, help="accepted languages")
+    select.add_argument("--years", nargs=2, type=int, default=None, help="first and last accepted year")
+    select.add_argument("--no-index", action="store_true", help="stream the input even if indexes exist")
+
+    sample = commands.add_parser("sample", help="draw a random sample from raw or sharded Edoc files")
+    sample.add_argument("path", help="file or folder of files")
+    sample.add_argument("save_path", help="path of the output file")
+    sample.add_argument("--size", type=int, default=None, help="sample size, required unless --quota is given")
+    sample.add_argument("--seed", type=int, default=None, help="seed for a reproducible sample")
+    sample.add_argument("--stratify", default=None, help="field to stratify by such as department, year or type")
+    sample.add_argument("--quota", nargs="+", default=None, help="sample size per stratum as value=size")
+
+    chi_square = commands.add_parser("chi-square", help="test many field distributions of a sample against raw data")
+    chi_square.add_argument("population", help="file or folder of files of the population")
+    chi_square.add_argument("--sample", default=None, help="file or folder of files of the sample")
+    chi_square.add_argument("--save", default=None, help="folder for the results, defaults to /analysis/chi_square")
+
+    serve = commands.add_parser("serve", help="serve a local stand-in for the Annif REST API")
+    serve.add_argument("--host", default="127.0.0.1", help="host name")
+    serve.add_argument("--port", type=int, default=5000, help="port")
+    serve.add_argument("--reference", default=None, help="reference keywords for the TF-IDF model")
+    serve.add_argument("--replay", nargs="+", default=None, help="files enriched with Annif to be replayed")
+
+    update = commands.add_parser("update", help="enrich only new and changed items of a new Edoc file")
+    update.add_argument("path", help="new Edoc file")
+    update.add_argument("--enriched", default=None,
+                        help="last enriched file, defaults to indexed.json in the work folder")
+    update.add_argument("--save", default=None, help="path of the output file, defaults to the last enriched file")
+    update.add_argument("--key", default="eprintid", help="field that identifies an item")
+    update.add_argument("--no-metrics", action="store_true", help="do not update the metrics")
+
+    metrics = commands.add_parser("metrics", help="make metrics for a slice of the confusion table, saved in the "
+                                                   "folder metrics next to the table")
+    metrics.add_argument("--table", default=None,
+                         help="confusion table, defaults to the table next to the enriched file of the pipeline")
+    metrics.add_argument("--build", default=None, help="enriched Edoc file to build the confusion table from first")
+    metrics.add_argument("--department", nargs="+", default=None, help="accepted departments")
+    metrics.add_argument("--year", nargs="+", default=None, help="accepted years")
+    metrics.add_argument("--type", nargs="+", default=None, help="accepted types")
+    metrics.add_argument("--language", nargs="+", default=None, help="accepted languages")
+
+    import_time = commands.add_parser("import-time", help="benchmark the import time of modules")
+    import_time.add_argument("modules", nargs="*", default=["files"], help="modules to be imported, defaults to files")
+    import_time.add_argument("--repeat", type=int, default=5, help="number of runs per module")
+    import_time.add_argument("--top", type=int, default=10, help="number of slowest imports to be listed")
+
+    refine = commands.add_parser("refine", help="replay the OpenRefine history to regenerate the keyword reference")
+    refine.add_argument("--history", default=None,
+                        help="OpenRefine history, defaults to /keywords/operation_history.json")
+    refine.add_argument("--histogram", default=None,
+                        help="keyword histogram, defaults to /keywords/keywords_clean_histogram.json")
+    refine.add_argument("--vocabulary", required=True, help="local vocabulary made by the vocabulary command")
+    refine.add_argument("--save", default=None,
+                        help="path of the output file, defaults to /keywords/keywords_reference_replayed.json")
+    refine.add_argument("--workers", type=int, default=4, help="number of worker processes")
+    refine.add_argument("--batch-size", type=int, default=None, help="number of rows per batch")
+
+    vocabulary = commands.add_parser("vocabulary", help="make the local vocabulary for refine from label dumps")
+    vocabulary.add_argument("wikidata", help="Wikidata Query Service JSON result with item labels, MeSH and YSO IDs")
+    vocabulary.add_argument("--mesh", default=None, help="MeSH descriptor XML file")
+    vocabulary.add_argument("--yso", default=None, help="YSO SKOS vocabulary as N-Triples")
+    vocabulary.add_argument("--save", default=None,
+                            help="path of the output file, defaults to /keywords/vocabulary.json")
+    vocabulary.add_argument("--validate", action="store_true",
+                            help="validate the vocabulary against the held-out keyword reference")
+    vocabulary.add_argument("--reference", default=None,
+                            help="keyword reference, defaults to /keywords/keywords_reference_master.json")
+
+    arguments = parser.parse_args()
+    if arguments.annif_api is not None:
+        Http.annif_api = arguments.annif_api
+    stages = Pipeline.get_stages(raw_path=arguments.raw, work_path=arguments.work)
+    indexed = [stage for stage in stages if stage.get("name") == "merge"][0].get("outputs")[0]
+
+    if arguments.command == "list":
+        dependencies = Pipeline.get_dependencies(stages)
+        for stage in stages:
+            state = "up to date" if Pipeline.is_up_to_date(stage) else "stale"
+            print(f"{stage.get('name')}: {state}; depends on {', '.join(dependencies.get(stage.get('name'))) or '-'}")
+
+    elif arguments.command == "index":
+        for file_path in Selection.get_paths(arguments.path):
+            index = Selection.build_index(file_path, fields=arguments.fields)
+            print(f"{file_path}: {index['items']} items indexed")
+
+    elif arguments.command == "select":
+        predicates = []
+        for field in ["department", "type", "language"]:
+            if getattr(arguments, field) is not None:
+                predicates.append(Selection.equals(field, *getattr(arguments, field)))
+        if arguments.years is not None:
+            predicates.append(Selection.between("year", *arguments.years))
+        predicates.append(Selection.has(*arguments.has))
+        Selection.select_to_file(arguments.path, arguments.save_path, Selection.all_of(*predicates),
+                                 use_index=not arguments.no_index)
+
+    elif arguments.command == "sample":
+        if arguments.quota is not None and arguments.stratify is None:
+            parser.error("sample: --quota requires --stratify")
+        if (arguments.size is None) == (arguments.quota is None):
+            parser.error("sample: give either --size or --quota")
+        quotas = None
+        if arguments.quota is not None:
+            if not all("=" in quota and quota.rsplit("=", 1)[1].isdigit() for quota in arguments.quota):
+                parser.error("sample: --quota must be given as value=size")
+            quotas = {quota.rsplit("=", 1)[0]: int(quota.rsplit("=", 1)[1]) for quota in arguments.quota}
+        Analysis.make_random_sample(arguments.path, arguments.save_path, size=arguments.size, seed=arguments.seed,
+                                    stratify=arguments.stratify, quotas=quotas)
+
+    elif arguments.command == "chi-square":
+        Analysis.make_chi_square(arguments.population, sample_path=arguments.sample, save_path=arguments.save)
+
+    elif arguments.command == "serve":
+        annif = LocalAnnif(reference_path=arguments.reference, replay_paths=arguments.replay)
+        annif.serve(arguments.host, arguments.port)
+
+    elif arguments.command == "update":
+        with Monitor.run("update"):
+            Incremental.update(arguments.path, enriched_path=arguments.enriched or indexed,
+                               save_path=arguments.save, key_field=arguments.key, metrics=not arguments.no_metrics,
+                               work_path=None if arguments.work is None else arguments.work + "/incremental")
+
+    elif arguments.command == "metrics":
+        if arguments.build is not None:
+            table_path = arguments.table or Analysis.get_table_path(arguments.build)
+            table = Analysis.make_confusion_table(arguments.build, save_path=table_path)
+        else:
+            table_path = arguments.table or Analysis.get_table_path(indexed)
+            table = Analysis.load_confusion_table(table_path)
+        selection = {field: getattr(arguments, field) for field in Analysis.slice_fields
+                     if getattr(arguments, field) is not None}
+        # save the metrics next to the table, not over the results in /metrics/:
+        save_path = os.path.join(os.path.dirname(os.path.abspath(table_path)), "metrics")
+        os.makedirs(save_path, exist_ok=True)
+        Analysis.make_slice_metrics(selection, table=table, save_path=save_path)
+
+    elif arguments.command == "import-time":
+        results = Utility.benchmark_import(arguments.modules, repeat=arguments.repeat, top=arguments.top)
+        for module, result in results.items():
+            for entry in result.get("slowest"):
+                print(f"  {module}: {entry['module']} {entry['cumulative ms']:.1f} ms")
+
+    elif arguments.command == "refine":
+        if arguments.batch_size is not None:
+            Refine.batch_size = arguments.batch_size
+        with Monitor.run("refine"):
+            Refine.replay(arguments.vocabulary, history_path=arguments.history, histogram_path=arguments.histogram,
+                          save_path=arguments.save, workers=arguments.workers)
+
+    elif arguments.command == "vocabulary":
+        Refine.make_vocabulary(arguments.wikidata, save_path=arguments.save, mesh_path=arguments.mesh,
+                               yso_path=arguments.yso)
+        if arguments.validate is True:
+            Refine.validate(arguments.save or DIR + "/keywords/vocabulary.json", reference_path=arguments.reference)
+
+    elif arguments.command == "run":
+        targets = arguments.stages if len(arguments.stages) > 0 else None
+        unknown = [name for name in arguments.stages if name not in [stage.get("name") for stage in stages]]
+        if len(unknown) > 0:
+            parser.error(f"unknown stages {', '.join(unknown)}; see python -m files list")
+        if arguments.dry_run is True:
+            Pipeline.run(stages, targets=targets, workers=arguments.workers, force=arguments.force, dry_run=True)
+        else:
+            with Monitor.run("pipeline", profile=arguments.profile, save_path=arguments.report,
+                             memory=arguments.trace_memory):
+                Pipeline.run(stages, targets=targets, workers=arguments.workers, force=arguments.force)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+""" Tests for the metrics computed from confusion counts. """
+
+import random
+import warnings
+
+import pytest
+
+import files
+from files import Analysis, Utility
+
+pytest.importorskip("numpy")
+metrics = pytest.importorskip("sklearn.metrics")
+
+
+def make_items(generator: random.Random) -> list:
+    """ Make random enriched Edoc items with Wikidata keywords and Annif suggestions.
+
+    :param generator: the random number generator
+    """
+
+    items = []
+    for _ in range(generator.randint(0, 6)):
+        keywords = generator.choice([None, 0, 1, 2, 5])
+        suggestions = generator.choice([0, 1, 3, 10])
+        enriched = []
+        if keywords is not None:
+            enriched = [{"qid": f"Q{generator.randint(1, 8)}", "yso id": ""} for _ in range(keywords)]
+            enriched.append({"qid": "", "yso id": ""})
+        items.append({"keywords enriched": enriched,
+                      "annif": {"wikidata-en-False-False-None-None":
+                                [{"uri": f"http://www.wikidata.org/entity/Q{generator.randint(1, 8)}"}
+                                 for _ in range(suggestions)]}})
+
+    return items
+
+
+def get_sklearn_metrics(standard: list,
+                        suggestions: list) -> dict:
+    """ Get the metrics of make_metrics computed by Sklearn.
+
+    :param standard: y_true
+    :param suggestions: y_pred
+    """
+
+    results = {"Sample size": len(standard)}
+    for average in ["binary", "macro", "micro", "weighted"]:
+        results[f"F1-{average}"] = metrics.f1_score(standard, suggestions, average=average)
+        results[f"Precision-{average}"] = metrics.precision_score(standard, suggestions, average=average,
+                                                                  zero_division=0)
+        results[f"Recall-{average}"] = metrics.recall_score(standard, suggestions, average=average, zero_division=0)
+    results.update(Analysis.count_confusion(standard, suggestions))
+
+    return results
+
+
+def test_compute_metrics_equals_sklearn():
+    """ compute_metrics on summed confusion counts equals Sklearn on the underlying y_true and y_pred. """
+
+    generator = random.Random(5)
+    compared = 0
+    for _ in range(300):
+        n = generator.randint(1, 10)
+        standard = []
+        suggestions = []
+        counts = [0, 0, 0, 0]
+        for item in make_items(generator):
+            sklearn_array = Analysis.get_sklearn_array(item, "wikidata-en", n=n)
+            if sklearn_array is None:
+                continue
+            standard = standard + sklearn_array.get("y_true")
+            suggestions = suggestions + sklearn_array.get("y_pred")
+            counts = [old + new for old, new in zip(counts, Analysis.get_confusion(item, "wikidata-en", n=n))]
+        if len(standard) == 0:
+            continue
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = get_sklearn_metrics(standard, suggestions)
+        computed = Analysis.compute_metrics(counts)
+        for name, value in expected.items():
+            assert computed[name] == pytest.approx(value, abs=1e-12), name
+        compared = compared + 1
+
+    assert compared > 150
+
+
+def test_department_slice_equals_make_metrics(tmp_path, monkeypatch):
+    """ The metrics of a department slice of the confusion table equal make_metrics for that department. """
+
+    monkeypatch.setattr(files, "DIR", str(tmp_path))
+    (tmp_path / "metrics").mkdir()
+
+    generator = random.Random(2)
+    data = []
+    for _ in range(120):
+        item = {"department": generator.choice(["A", "B", "C"]), "date": generator.choice([2019, 2020])}
+        item["keywords enriched"] = [{"qid": f"Q{generator.randint(1, 9)}",
+                                      "yso id": f"http://www.yso.fi/onto/yso/p{generator.randint(1, 9)}"}
+                                     for _ in range(generator.randint(0, 3))]
+        item["annif"] = dict()
+        for project_id, uri in [("yso-en", "http://www.yso.fi/onto/yso/p{}"),
+                                ("wikidata-en", "http://www.wikidata.org/entity/Q{}")]:
+            for abstract in [False, True]:
+                item["annif"][f"{project_id}-{abstract}-False-None-None"] = \
+                    [{"uri": uri.format(generator.randint(1, 9))} for _ in range(generator.randint(0, 10))]
+        data.append(item)
+    file_path = str(tmp_path / "indexed.json")
+    Utility.save_json(data, file_path)
+
+    table = Analysis.build_confusion_table(data)
+    assert table["counts"].shape == (len(data), len(Analysis.get_markers()), 4)
+    assert int(Analysis.get_slice_counts(table, {"department": "A"})["wikidata-en-False-False-3-None"][0]) == \
+        sum(Analysis.get_confusion(item, "wikidata-en", n=3)[0] for item in data if item["department"] == "A"
+            and Analysis.get_confusion(item, "wikidata-en", n=3) is not None)
+
+    sliced = Analysis.make_slice_metrics({"department": "A"}, table=table, save=False)
+    for project_id in ["yso-en", "wikidata-en"]:
+        for abstract in [False, True]:
+            for n in [1, 5, 10]:
+                marker = f"{project_id}-{abstract}-False-{n}-None"
+                with warnings.catch_warnings():
+                    warnings.simplefilter("ignore")
+                    Analysis.make_metrics(file_path, project_id, abstract=abstract, n=n, department="A")
+                expected = Utility.load_json(str(tmp_path / "metrics" / f"metrics_A_{marker}.json"))
+                for name, value in expected.items():
+                    assert sliced[marker][name] == pytest.approx(value, abs=1e-12), (marker, name)
@@ -0,0 +1,117 @@
+""" Tests for the shared HTTP layer with a fake connection pool. """
+
+import threading
+import time
+
+import pytest
+
+from files import Http, Monitor
+
+pytest.importorskip("urllib3")
+
+
+class Response:
+    """ A response of the fake connection pool. """
+
+    def __init__(self,
+                 status: int,
+                 data: bytes = b"") -> None:
+        self.status = status
+        self.data = data
+
+
+class Pool:
+    """ A fake connection pool that answers with the statuses queued per URL, else with 200. """
+
+    def __init__(self,
+                 delay: float = 0.0) -> None:
+        self.delay = delay
+        self.statuses = dict()
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def request(self, method: str, url: str, fields: dict = None, **options) -> Response:
+        start = time.monotonic()
+        time.sleep(self.delay)
+        with self.lock:
+            statuses = self.statuses.get(url, [])
+            status = statuses.pop(0) if len(statuses) > 0 else 200
+            self.calls.append({"url": url, "status": status, "start": start, "end": time.monotonic()})
+
+        return Response(status, url.encode("utf-8"))
+
+
+@pytest.fixture
+def pool(monkeypatch) -> Pool:
+    """ Replace the connection pool of Http by a fake one and reset the host states. """
+
+    Http.get_loop()
+    pool = Pool()
+    monkeypatch.setattr(Http, "pool", pool)
+    monkeypatch.setattr(Http, "states", dict())
+    monkeypatch.setattr(Http, "inflight", dict())
+    monkeypatch.setattr(Http, "retries", 2)
+    monkeypatch.setattr(Http, "backoff", 0.01)
+    monkeypatch.setattr(Http, "failure_threshold", 3)
+    monkeypatch.setattr(Http, "cooldown", 0.2)
+    Monitor.start_run("test http")
+
+    return pool
+
+
+def test_concurrent_identical_requests_are_coalesced(pool):
+    """ Identical requests in flight at the same time are sent once. """
+
+    pool.delay = 0.1
+    url = "http://test.invalid/same"
+
+    results = Http.gather(Http.request("GET", url) for _ in range(5))
+
+    assert results == [url.encode("utf-8")] * 5
+    assert len(pool.calls) == 1
+
+
+def test_failures_are_retried(pool):
+    """ Status 503 is retried with backoff until the request succeeds. """
+
+    url = "http://test.invalid/flaky"
+    pool.statuses[url] = [503, 503]
+
+    assert Http.run(Http.request("GET", url)) == url.encode("utf-8")
+    assert [call["status"] for call in pool.calls] == [503, 503, 200]
+    assert Monitor.counters.get("http test.invalid retries") == 2
+
+
+def test_failed_requests_return_none(pool):
+    """ A request that fails does not abort the others in gather. """
+
+    urls = [f"http://test.invalid/{number}" for number in range(4)]
+    pool.statuses[urls[1]] = [404]
+    pool.statuses[urls[2]] = [500, 500, 500]
+
+    assert Http.gather(Http.request("GET", url) for url in urls) == \
+        [urls[0].encode("utf-8"), None, None, urls[3].encode("utf-8")]
+    assert Monitor.counters.get("http failures") == 2
+
+
+def test_open_circuit_lets_one_probe_through(pool):
+    """ After the cooldown, one probe reaches the host while the other requests wait for it. """
+
+    failing = "http://test.invalid/down"
+    pool.statuses[failing] = [503] * 3
+    with pytest.raises(ConnectionError):
+        Http.run(Http.request("GET", failing))
+    state = Http.get_state("test.invalid")
+    assert state.get("failures") == 3
+    assert state.get("open until") > time.monotonic()
+
+    pool.delay = 0.05
+    pool.calls = []
+    urls = [f"http://test.invalid/up/{number}" for number in range(5)]
+    results = Http.gather(Http.request("GET", url) for url in urls)
+
+    assert results == [url.encode("utf-8") for url in urls]
+    probe = pool.calls[0]
+    assert all(call["start"] >= probe["end"] for call in pool.calls[1:])
+    assert Monitor.counters.get("http test.invalid circuit probes") == 1
+    assert state.get("failures") == 0
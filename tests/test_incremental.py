@@ -0,0 +1,34 @@
+""" Tests for matching new Edoc items against enriched ones. """
+
+from files import Incremental
+
+
+def test_split_matches_duplicates_pairwise():
+    """ Duplicates sharing a content hash key are each matched once, and the surplus one is stale. """
+
+    enriched = [{"title": "a", "abstract": "x", "keywords": "k", "annif": {}},
+                {"title": "a", "abstract": "x", "keywords": "k", "annif": {}},
+                {"title": "b", "abstract": "x", "keywords": "k", "annif": {}}]
+    new = [{"title": "a", "abstract": "x", "keywords": "k"},
+           {"title": "c", "abstract": "x", "keywords": "k"}]
+
+    changed, unchanged, stale = Incremental.split(new, enriched)
+
+    assert changed == [new[1]]
+    assert unchanged == {0: 0}
+    assert stale == [enriched[1], enriched[2]]
+
+
+def test_split_detects_changed_content():
+    """ An item whose content hash changed is enriched again and its old version is stale. """
+
+    enriched = [{"eprintid": 1, "title": "a", "abstract": "x", "keywords": "k"},
+                {"eprintid": 2, "title": "b", "abstract": "x", "keywords": "k"}]
+    new = [{"eprintid": 2, "title": "b", "abstract": "x", "keywords": "k"},
+           {"eprintid": 1, "title": "a2", "abstract": "x", "keywords": "k"}]
+
+    changed, unchanged, stale = Incremental.split(new, enriched)
+
+    assert changed == [new[1]]
+    assert unchanged == {0: 1}
+    assert stale == [enriched[0]]
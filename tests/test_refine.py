@@ -0,0 +1,119 @@
+""" Tests for the local vocabulary and the expressions of the OpenRefine replay. """
+
+import json
+
+import pytest
+
+from files import Refine
+
+WIKIDATA = {"head": {"vars": ["item", "itemLabel", "altLabel", "mesh", "yso"]},
+            "results": {"bindings": [
+                {"item": {"type": "uri", "value": "http://www.wikidata.org/entity/Q1057"},
+                 "itemLabel": {"type": "literal", "value": "metabolism"},
+                 "altLabel": {"type": "literal", "value": "metabolic process"},
+                 "mesh": {"type": "literal", "value": "D008660"},
+                 "yso": {"type": "literal", "value": "3066"}},
+                {"item": {"type": "uri", "value": "http://www.wikidata.org/entity/Q1057"},
+                 "itemLabel": {"type": "literal", "value": "metabolism"},
+                 "altLabel": {"type": "literal", "value": "metabolic"}},
+                {"item": {"type": "uri", "value": "http://www.wikidata.org/entity/Q7187"},
+                 "itemLabel": {"type": "literal", "value": "gene"},
+                 "yso": {"type": "literal", "value": "8500"}},
+                {"item": {"type": "uri", "value": "http://www.wikidata.org/entity/Q2"},
+                 "itemLabel": {"type": "literal", "value": "Earth"}},
+                {"item": {"type": "uri", "value": "http://www.wikidata.org/entity/Q3"},
+                 "itemLabel": {"type": "literal", "value": "earth"}}]}}
+
+MESH = """<?xml version="1.0"?>
+<DescriptorRecordSet>
+  <DescriptorRecord>
+    <DescriptorUI>D008660</DescriptorUI>
+    <DescriptorName><String>Metabolism</String></DescriptorName>
+    <ConceptList><Concept><TermList>
+      <Term><String>Metabolism</String></Term>
+      <Term><String>Metabolic Phenomena</String></Term>
+    </TermList></Concept></ConceptList>
+  </DescriptorRecord>
+</DescriptorRecordSet>
+"""
+
+YSO = """<http://www.yso.fi/onto/yso/p8500> <http://www.w3.org/2004/02/skos/core#prefLabel> "genes"@en .
+<http://www.yso.fi/onto/yso/p8500> <http://www.w3.org/2004/02/skos/core#prefLabel> "geenit"@fi .
+<http://www.yso.fi/onto/yso/p8500> <http://www.w3.org/2004/02/skos/core#altLabel> "\\"hereditary\\" units"@en .
+"""
+
+
+@pytest.fixture
+def vocabulary_path(tmp_path) -> str:
+    """ Make a vocabulary from small Wikidata, MeSH and YSO dumps and return its path. """
+
+    (tmp_path / "wikidata.json").write_text(json.dumps(WIKIDATA), encoding="utf-8")
+    (tmp_path / "mesh.xml").write_text(MESH, encoding="utf-8")
+    (tmp_path / "yso.nt").write_text(YSO, encoding="utf-8")
+    save_path = str(tmp_path / "vocabulary.json")
+    Refine.make_vocabulary(str(tmp_path / "wikidata.json"), save_path=save_path, mesh_path=str(tmp_path / "mesh.xml"),
+                           yso_path=str(tmp_path / "yso.nt"))
+
+    return save_path
+
+
+def test_make_vocabulary_merges_labels(vocabulary_path):
+    """ The entries hold the Wikidata, MeSH and YSO labels of the same concept. """
+
+    with open(vocabulary_path, encoding="utf-8") as file:
+        entries = {entry["qid"]: entry for entry in json.load(file)}
+
+    assert entries["Q1057"] == {"qid": "Q1057", "wikidata label": "metabolism", "mesh id": "D008660", "yso id": 3066,
+                                "labels": ["metabolic process", "metabolic", "Metabolism", "Metabolic Phenomena"]}
+    assert entries["Q7187"]["labels"] == ["genes", "\"hereditary\" units"]
+
+
+def test_reconcile_with_vocabulary(vocabulary_path):
+    """ Labels from any dump are matched; labels of several entries only give candidates. """
+
+    vocabulary = Refine.get_vocabulary(vocabulary_path)
+
+    assert Refine.reconcile("Metabolic  Phenomena", vocabulary)["match"]["id"] == "Q1057"
+    assert Refine.reconcile("genes", vocabulary)["match"] == {"id": "Q7187", "name": "gene", "score": 100}
+    ambiguous = Refine.reconcile("earth", vocabulary)
+    assert ambiguous["match"] is None
+    assert [candidate["id"] for candidate in ambiguous["candidates"]] == ["Q2", "Q3"]
+
+
+def test_validate_on_held_out_reference(vocabulary_path, tmp_path):
+    """ Precision and recall are measured on reference keywords that the vocabulary was not made from. """
+
+    reference = [{"keyword clean": "metabolic", "qid": "Q1057"},
+                 {"keyword clean": "genes", "qid": "Q7187"},
+                 {"keyword clean": "gene", "qid": "Q999"},
+                 {"keyword clean": "earth", "qid": "Q2"},
+                 {"keyword clean": "unknown", "qid": ""}]
+    reference_path = tmp_path / "reference.json"
+    reference_path.write_text(json.dumps(reference), encoding="utf-8")
+
+    results = Refine.validate(vocabulary_path, reference_path=str(reference_path),
+                              save_path=str(tmp_path / "validation.json"))
+
+    assert results == {"keywords": 4, "matched": 3, "correct": 2, "precision": 2 / 3, "recall": 0.5,
+                       "candidate recall": 0.75}
+    with pytest.raises(ValueError):
+        Refine.validate(vocabulary_path, reference_path=vocabulary_path)
+
+
+def test_replay_needs_separate_vocabulary(vocabulary_path):
+    """ The vocabulary cannot be overwritten by the output of the replay. """
+
+    with pytest.raises(ValueError):
+        Refine.replay(vocabulary_path, save_path=vocabulary_path)
+
+
+def test_jython_expressions_are_mapped():
+    """ The Jython expression of the history runs natively and other Jython expressions are unsupported. """
+
+    expression = Refine.get_expression('jython:if value is None:\n return None\nif "studies" in value:\n'
+                                       ' return value.replace("studies", "study")\nelse:\n return value.rstrip("s")')
+
+    assert [expression({"cells": {"keyword": value}}, "keyword", dict())
+            for value in ["case studies", "floods", "glass", None]] == ["case study", "flood", "gla", None]
+    with pytest.raises(ValueError):
+        Refine.get_expression("jython:return value.upper()")